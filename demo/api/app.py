@@ -22,6 +22,7 @@ from models import (LabelsModel, ObjectIdField, PostModel,
                     PrecomputedOverviewModel, StoredOverviewModel)
 from pipeline import Pipeline
 from store import P
+from util.disconnect import DisconnectMiddleware
 from util.thread import CancableThread
 
 
@@ -109,6 +110,7 @@ STATIC_LIST = [
 pipeline = Pipeline()
 
 app = FastAPI()
+app.add_middleware(DisconnectMiddleware)
 
 if DEVELOP:
     app.add_middleware(
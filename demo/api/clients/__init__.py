@@ -6,8 +6,8 @@ from .language_model_client import LLMClient
 NON_ALPHANUM_RE = re.compile(r"[^a-z0-9_]")
 
 
-def get_llm_client(model, host=None, api_key=None):
+def get_llm_client(model, host=None, api_key=None, priority=None):
     if model in OpenAIClient.MODELS:
         return OpenAIClient(model=model, api_key=api_key)
     model = NON_ALPHANUM_RE.sub("", model.lower().replace("-", "_").replace("+", "p"))
-    return LLMClient(model=model, host=host)
+    return LLMClient(model=model, host=host, priority=priority)
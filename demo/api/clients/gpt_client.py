@@ -172,6 +172,9 @@ class OpenAIClient:
         counter.consume()
         return counter.results()
 
+    def count_tokens_batch(self, texts, indicate_shared=False):
+        return [self.count_tokens(text, indicate_shared) for text in texts]
+
     def __call__(
         self,
         batch,
@@ -0,0 +1,60 @@
+import numpy as np
+from tokenizers import Tokenizer
+
+
+def assign_counts(ends, lengths, indicate_shared=False):
+    boundaries = np.cumsum(lengths)
+    reached = np.maximum.accumulate(ends) if len(ends) else np.zeros(0, dtype=int)
+    num_committed = int(
+        np.searchsorted(boundaries, reached[-1] if len(reached) else 0, side="right")
+    )
+    starts = np.concatenate(([0], reached[:-1]))
+    segments = np.searchsorted(boundaries, starts, side="right")
+    counts = np.bincount(segments, minlength=len(boundaries) + 1)[:num_committed]
+    counts = [int(count) for count in counts]
+    if indicate_shared and len(reached):
+        boundaries = boundaries[:num_committed]
+        first_reaching = reached[np.searchsorted(reached, boundaries)]
+        is_partial = (first_reaching != boundaries) & (boundaries != 0)
+        counts = [
+            count + 0.5 if partial else count
+            for count, partial in zip(counts, is_partial)
+        ]
+    return counts
+
+
+class LocalTokenizer:
+    def __init__(self, definition):
+        self.tokenizer = Tokenizer.from_str(definition)
+        self.tokenizer.no_truncation()
+        self.tokenizer.no_padding()
+
+    def count_tokens_batch(self, texts, indicate_shared=False):
+        documents = [[text] if isinstance(text, str) else text for text in texts]
+        encodings = self.tokenizer.encode_batch(
+            ["".join(document) for document in documents]
+        )
+        results = []
+        for text, document, encoding in zip(texts, documents, encodings):
+            is_content = np.array(encoding.special_tokens_mask, dtype=bool) == 0
+            offsets = np.array(encoding.offsets, dtype=int).reshape(-1, 2)
+            ends = offsets[is_content, 1]
+            counts = assign_counts(ends, [len(e) for e in document], indicate_shared)
+            if isinstance(text, str):
+                (counts,) = counts
+            num_all_tokens = len(encoding.ids)
+            results.append(
+                {
+                    "counts": counts,
+                    "num": {
+                        "all": num_all_tokens,
+                        "special": num_all_tokens - len(ends),
+                        "non_special": len(ends),
+                    },
+                }
+            )
+        return results
+
+    def count_tokens(self, text, indicate_shared=False):
+        (result,) = self.count_tokens_batch([text], indicate_shared)
+        return result
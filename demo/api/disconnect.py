@@ -4,14 +4,10 @@ from functools import wraps
 
 from fastapi.exceptions import HTTPException
 from util.aio import wait_first
+from util.disconnect import disconnect_event
 from util.thread import CancableThread
 
 
-async def _check_disconnected(request):
-    while not await request.is_disconnected():
-        await asyncio.sleep(1)
-
-
 def cancel_on_disconnect(func):
     @wraps(func)
     async def wrapper(**kwargs):
@@ -21,7 +17,7 @@ def cancel_on_disconnect(func):
         else:
             called = CancableThread(target=lambda: func(**kwargs)).execute()
         called = asyncio.ensure_future(called)
-        checker = _check_disconnected(request)
+        checker = disconnect_event(request).wait()
         result, done_coro = await wait_first([checker, called])
         if done_coro is checker:
             called.cancel()
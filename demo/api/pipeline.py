@@ -1,3 +1,5 @@
+from concurrent.futures import ThreadPoolExecutor
+
 from clients import get_llm_client
 from clustering import ThreadClusterer, result_to_clusters
 from config import MODEL_HOSTS
@@ -15,6 +17,7 @@ class Summarizer:
         host=None,
         api_key=None,
         max_new_tokens=64,
+        max_workers=8,
     ):
         if host is None:
             host = MODEL_HOSTS
@@ -24,15 +27,25 @@ class Summarizer:
         self.host = host
         self.api_key = api_key
         self.max_new_tokens = max_new_tokens
+        self.max_workers = max_workers
         self.extra_kwargs = {}
 
     def _get_client(self, model):
         if model not in self.clients:
             self.clients[model] = get_llm_client(
-                model=model, host=self.host, api_key=self.api_key
+                model=model,
+                host=self.host,
+                api_key=self.api_key,
+                priority="interactive",
             )
         return self.clients[model]
 
+    def _map(self, function, items, **kwargs):
+        keys = list(items.keys())
+        with ThreadPoolExecutor(self.max_workers) as executor:
+            results = executor.map(lambda key: function(items[key], **kwargs), keys)
+            return dict(zip(keys, results))
+
     def label(
         self,
         tree,
@@ -56,14 +69,8 @@ class Summarizer:
             **extra_kwargs
         )
         clusters = result_to_clusters(tree["result"])
-        labels = {
-            str(key): labeler(
-                value,
-                temperature=temperature,
-                top_p=top_p,
-            )
-            for key, value in clusters.items()
-        }
+        labels = self._map(labeler, clusters, temperature=temperature, top_p=top_p)
+        labels = {str(key): value for key, value in labels.items()}
         tree["labels"][self.label_model] = labels
         meta = labeler.meta()
         meta.update(
@@ -96,10 +103,12 @@ class Summarizer:
             max_new_tokens=self.max_new_tokens,
             **extra_kwargs
         )
-        frames = {
-            key: framer(value, temperature=temperature, top_p=top_p)
-            for key, value in tree["labels"][self.label_model].items()
-        }
+        frames = self._map(
+            framer,
+            tree["labels"][self.label_model],
+            temperature=temperature,
+            top_p=top_p,
+        )
         tree["frames"].setdefault(self.label_model, {}).update(
             {self.frame_model: frames}
         )
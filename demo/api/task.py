@@ -5,7 +5,7 @@ from clients.gpt_client import OpenAIClient
 from template import Template
 from templates import TEMPLATES
 from util.frames import parse_frames
-from util.trim import trim_text
+from util.trim import count_template, normalize, pseudo_join, trim_text
 
 NON_ALPHANUM_RE = re.compile(r"[^a-z0-9_]")
 
@@ -108,10 +108,31 @@ The user presents a debate and the assistant generates a single descriptive phra
         if max_length is None:
             max_length = self.info.pop("max_length", float("inf"))
         self.max_length = min(max_length, client.meta()["model_max_length"])
+        self.trims_on_server = hasattr(client, "generate_trimmed")
+        if self.trims_on_server:
+            self.template_size = None
+        else:
+            self.template_size = count_template(client, self.partial_filled_template)
 
-    def preprocess(self, text):
+    @staticmethod
+    def sort(text):
         text = sorted(text, key=lambda x: x["lambda"], reverse=True)
-        text = [e["text"] for e in text]
+        return [e["text"] for e in text]
+
+    def __call__(self, text, **kwargs):
+        if not self.trims_on_server:
+            return super().__call__(text, **kwargs)
+        result = self.client.generate_trimmed(
+            self.partial_filled_template,
+            pseudo_join([normalize(e) for e in self.sort(text)]),
+            max_length=self.max_length * 0.8,
+            max_new_tokens=self.max_new_tokens,
+            **self.client_kwargs,
+        )
+        return self.postprocess(result["generated"])
+
+    def preprocess(self, text):
+        text = self.sort(text)
         if isinstance(self.client, OpenAIClient):
             multiplier = 1
             backoff = 10
@@ -126,6 +147,7 @@ The user presents a debate and the assistant generates a single descriptive phra
             max_length=self.max_length * multiplier,
             max_new_tokens=self.max_new_tokens,
             backoff=backoff,
+            template_size=self.template_size,
         )
         return text
 
@@ -0,0 +1,55 @@
+import asyncio
+
+
+class DisconnectWatcher:
+    def __init__(self, receive):
+        self._receive = receive
+        self.event = asyncio.Event()
+        self.messages = asyncio.Queue()
+        self.listener = None
+
+    async def _listen(self):
+        while True:
+            message = await self._receive()
+            self.messages.put_nowait(message)
+            if message["type"] == "http.disconnect":
+                self.event.set()
+                return
+
+    def watch(self):
+        if self.listener is None and not self.event.is_set():
+            self.listener = asyncio.ensure_future(self._listen())
+        return self.event
+
+    async def receive(self):
+        if self.listener is None:
+            message = await self._receive()
+            if message["type"] == "http.disconnect":
+                self.event.set()
+            return message
+        if self.event.is_set() and self.messages.empty():
+            return {"type": "http.disconnect"}
+        return await self.messages.get()
+
+    def close(self):
+        if self.listener is not None:
+            self.listener.cancel()
+
+
+class DisconnectMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        watcher = DisconnectWatcher(receive)
+        scope["disconnect_watcher"] = watcher
+        try:
+            await self.app(scope, watcher.receive, send)
+        finally:
+            watcher.close()
+
+
+def disconnect_event(request):
+    return request.scope["disconnect_watcher"].watch()
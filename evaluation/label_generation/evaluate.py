@@ -1,6 +1,8 @@
 #!/usr/bin/env python
 
 import argparse
+import asyncio
+import inspect
 import json
 import sys
 from collections import OrderedDict, defaultdict
@@ -116,10 +118,10 @@ class Hypotheses(list):
 
 
 def get_bertscorer():
-    from client import MetricClient
+    from client import AsyncMetricClient
     dotenv.load_dotenv()
     MODEL_HOSTS = environ["MODEL_HOSTS"].split()
-    return MetricClient("bertscore", host=MODEL_HOSTS)
+    return AsyncMetricClient("bertscore", host=MODEL_HOSTS, priority="batch")
 
 
 from rouge import Rouge as _Rouge
@@ -142,6 +144,17 @@ def get_rouge():
     return Rouge()
 
 
+def score_batches(metric, batches):
+    if not inspect.iscoroutinefunction(metric.__call__):
+        return [metric(batch) for batch in batches]
+
+    async def gather():
+        async with metric:
+            return await asyncio.gather(*(metric(batch) for batch in batches))
+
+    return asyncio.run(gather())
+
+
 def ibatch(*args, batch_size):
     args = [iter(e) for e in args]
     if len(args) > 1:
@@ -198,9 +211,11 @@ class Scores:
                     )
         if pairs:
             metric = get_metric()
-            for batch in ibatch(pairs, batch_size=128):
-                keys, pairs = map(list, zip(*batch))
-                example_scores = metric(pairs)
+            batches = [
+                tuple(map(list, zip(*batch))) for batch in ibatch(pairs, batch_size=128)
+            ]
+            all_scores = score_batches(metric, [pairs for _, pairs in batches])
+            for (keys, _), example_scores in zip(batches, all_scores):
                 for key, score in zip(keys, example_scores):
                     id_dict = self.scores.setdefault(key["model"], {})
                     reference_dict = id_dict.setdefault(key["id"], {})
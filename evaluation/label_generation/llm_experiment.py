@@ -25,9 +25,16 @@ dotenv.load_dotenv()
 MODEL_HOSTS = environ["MODEL_HOSTS"].split()
 OPENAI_API_KEY = environ["OPENAI_API_KEY"]
 
-experiments = Experiments(MODEL_LOOKUP, host=MODEL_HOSTS, api_key=OPENAI_API_KEY)
+experiments = Experiments(
+    MODEL_LOOKUP,
+    host=MODEL_HOSTS,
+    api_key=OPENAI_API_KEY,
+    priority="batch",
+    websocket=True,
+)
 
 SPACE_RE = re.compile(r"\s+")
+COUNT_BATCH_SIZE = 256
 
 
 parser = argparse.ArgumentParser()
@@ -71,16 +78,6 @@ def get_labeled_clusters(discussions, ignore_none=False):
     return labeled_clusters
 
 
-def get_diff_indexes(arr):
-    if len(arr) == 0:
-        return []
-    diff_arr = np.diff(arr)
-    (indices,) = np.where(diff_arr != 0)
-    indices += 1
-    indices = [0, *(int(e) for e in indices)]
-    return indices
-
-
 def normalize(text):
     return SPACE_RE.sub(" ", text).strip()
 
@@ -93,18 +90,24 @@ def pseudo_join(texts, join_string=" "):
     return [first, *rest]
 
 
+def trim_segments(template, text):
+    text = pseudo_join([normalize(e) for e in text])
+    if "{input}" in template:
+        template_prefix, template_suffix = template.split("{input}")
+    else:
+        template_prefix, template_suffix = template, ""
+    return [template_prefix, *text, template_suffix]
+
+
 def trim_text(
     client,
     template,
     text,
     max_length=None,
+    size_info=None,
     **client_kwargs,
 ):
-    text = pseudo_join([normalize(e) for e in text])
-    if "{input}" in template:
-        template_prefix, template_suffix = template.split("{input}")
-    else:
-        template_prefix, template_suffix = template, ""
+    _, *text, _ = segments = trim_segments(template, text)
     if max_length is not None and max_length > 1:
         model_max_length = max_length
     else:
@@ -114,22 +117,16 @@ def trim_text(
         if max_length is not None:
             model_max_length *= max_length
     model_max_length = int(model_max_length)
-    size_info = client.count_tokens([template_prefix, *text, template_suffix])
+    if size_info is None:
+        size_info = client.count_tokens(segments)
     template_start, *counts, template_end = size_info["counts"]
     max_tokens = (
         model_max_length - template_start - template_end - size_info["num"]["special"]
     )
     if "max_new_tokens" in client_kwargs:
         max_tokens -= client_kwargs["max_new_tokens"]
-    cum_tokens = np.cumsum(counts)
-    is_less = cum_tokens < max_tokens
-    diff_indexes = get_diff_indexes(is_less)[1:]
-    if diff_indexes:
-        (upper,) = diff_indexes
-        selected_text = text[:upper]
-    else:
-        selected_text = text
-    return "".join(selected_text)
+    upper = int(np.searchsorted(np.cumsum(counts), max_tokens, side="left"))
+    return "".join(text[:upper])
 
 
 try:
@@ -205,19 +202,35 @@ except:
 results["template"] = experiment.template.raw()
 generated = results.setdefault("generated", {})
 
-for i, (key, cluster) in enumerate(clusters.items()):
+pending = [key for key in clusters if key not in generated]
+size_infos = []
+for start in range(0, len(pending), COUNT_BATCH_SIZE):
+    size_infos.extend(
+        experiment.client.count_tokens_batch(
+            [
+                trim_segments(experiment.template.raw(), clusters[key]["sentences"])
+                for key in pending[start : start + COUNT_BATCH_SIZE]
+            ]
+        )
+    )
+texts = []
+for i, (key, size_info) in enumerate(zip(pending, size_infos)):
     print(i)
-    sentences = cluster["sentences"]
-    if key not in generated:
-        text = trim_text(
+    texts.append(
+        trim_text(
             experiment.client,
             experiment.template.raw(),
-            sentences,
+            clusters[key]["sentences"],
             max_length=max_length,
+            size_info=size_info,
             **trim_kwargs,
         )
-        result = experiment(text, **client_kwargs).strip().removesuffix('"')
-        if default_bias:
-            result = result.removeprefix(default_bias)
-        generated[key] = result
-        GENERATED_PATH.write_text(json.dumps(results))
+    )
+
+for i, result in experiment.imap_unordered(texts, **client_kwargs):
+    key = pending[i]
+    result = result.strip().removesuffix('"')
+    if default_bias:
+        result = result.removeprefix(default_bias)
+    generated[key] = result
+    GENERATED_PATH.write_text(json.dumps(results))
@@ -1,14 +1,16 @@
 import re
 
+from .async_client import AsyncLLMClient, AsyncMetricClient
 from .gpt_client import OpenAIClient
 from .language_model_client import LLMClient
 from .metric_client import MetricClient
+from .websocket_client import WebsocketLLMClient, WebsocketMetricClient
 
 NON_ALPHANUM_RE = re.compile(r"[^a-z0-9_]")
 
 
-def get_llm_client(model, host=None, api_key=None):
+def get_llm_client(model, host=None, api_key=None, priority=None):
     if model in OpenAIClient.MODELS:
         return OpenAIClient(model=model, api_key=api_key)
     model = re.sub("", model.lower().replace("-", "_").replace("+", "p"))
-    return LLMClient(model=model, host=host)
+    return LLMClient(model=model, host=host, priority=priority)
@@ -0,0 +1,171 @@
+import asyncio
+import json
+
+import httpx
+
+from .client_base import ClientBase, OverloadedError, merge_results
+from .language_model_client import LLMClient
+from .metric_client import MetricClient
+
+
+class AsyncClientBase(ClientBase):
+    def __init__(self, *args, concurrency=8, timeout=None, **kwargs):
+        super().__init__(*args, timeout=timeout, **kwargs)
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=concurrency, max_keepalive_connections=concurrency
+            ),
+            timeout=timeout,
+        )
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *_):
+        await self.aclose()
+
+    async def aclose(self):
+        await self.client.aclose()
+
+    async def _arequest(self, method, url, size=0, **kwargs):
+        kwargs.setdefault("headers", self.headers)
+
+        async def request(host):
+            async with self.semaphore:
+                response = await self.client.request(method, f"{host}{url}", **kwargs)
+            return self._verify(response)
+
+        if self.replicas is None:
+            return await request(self.host)
+        return await self.replicas.acall(
+            request,
+            size,
+            retry_on=(OverloadedError,),
+            unavailable_on=(httpx.TransportError,),
+        )
+
+    async def _aget(self, url, data_only=True, **kwargs):
+        result = await self._arequest("GET", url, **kwargs)
+        if data_only:
+            return result["data"]
+        return result
+
+    async def _apost(self, url, data_only=True, **kwargs):
+        result = await self._arequest("POST", url, **kwargs)
+        if data_only:
+            return result["data"]
+        return result
+
+    async def _apost_batch(self, url, arguments, **kwargs):
+        batch = arguments["batch"]
+        results = await asyncio.gather(
+            *(
+                self._apost(
+                    url,
+                    json={**arguments, "batch": batch[start:end]},
+                    data_only=False,
+                    size=end - start,
+                    **kwargs,
+                )
+                for start, end in self._shards(len(batch))
+            )
+        )
+        if len(results) == 1:
+            (result,) = results
+            return result
+        return merge_results(results)
+
+    async def ameta(self):
+        return (await self._aget("/health", data_only=False))["meta"]
+
+    async def acount_tokens(self, text, indicate_shared=False, data_only=True):
+        return await self._apost(
+            "/tokenizer/count",
+            json={"text": text, "indicate_shared": indicate_shared},
+            data_only=data_only,
+        )
+
+    async def acount_tokens_batch(self, texts, indicate_shared=False, data_only=True):
+        return await self._apost(
+            "/tokenizer/count/batch",
+            json={"texts": texts, "indicate_shared": indicate_shared},
+            data_only=data_only,
+        )
+
+
+class AsyncLLMClient(AsyncClientBase, LLMClient):
+    async def __call__(
+        self,
+        batch,
+        max_new_tokens=None,
+        stopping_strings=None,
+        raise_overflow=True,
+        with_meta=False,
+    ):
+        is_single = not isinstance(batch, list)
+        if is_single:
+            batch = [batch]
+        args = self._arguments(batch, max_new_tokens, stopping_strings)
+        result = await self._apost_batch(
+            "/", args, headers=self._request_headers(with_meta)
+        )
+        return self._unpack(result, is_single, raise_overflow, with_meta)
+
+    async def stream(
+        self,
+        batch,
+        on_text,
+        max_new_tokens=None,
+        stopping_strings=None,
+        raise_overflow=True,
+        with_meta=False,
+    ):
+        is_single = not isinstance(batch, list)
+        if is_single:
+            batch = [batch]
+        args = self._arguments(batch, max_new_tokens, stopping_strings)
+        result = None
+        async with self.semaphore, self.client.stream(
+            "POST",
+            f"{self.host}/stream",
+            json=args,
+            headers=self._request_headers(with_meta),
+        ) as response:
+            if not response.headers["content-type"].startswith("text/event-stream"):
+                await response.aread()
+                self._verify(response)
+                raise ValueError("the server did not answer with an event stream")
+            event = None
+            async for line in response.aiter_lines():
+                if line.startswith("event: "):
+                    event = line.removeprefix("event: ")
+                elif line.startswith("data: "):
+                    data = json.loads(line.removeprefix("data: "))
+                    if event == "result":
+                        result = self._verify_result(data)
+                    elif is_single:
+                        on_text(data["text"])
+                    else:
+                        on_text(data["index"], data["text"])
+                    event = None
+        if result is None:
+            raise ValueError("the stream ended without a result")
+        return self._unpack(result, is_single, raise_overflow, with_meta)
+
+
+class AsyncMetricClient(AsyncClientBase, MetricClient):
+    async def __call__(
+        self,
+        batch,
+        select=None,
+        with_meta=False,
+    ):
+        is_single = not isinstance(batch, list)
+        if is_single:
+            batch = [batch]
+        args = self._arguments(batch, select)
+        result = await self._apost_batch(
+            "/", args, headers=self._request_headers(with_meta)
+        )
+        return self._unpack(result, is_single, with_meta)
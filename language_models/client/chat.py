@@ -197,10 +197,12 @@ class ChatClient:
     def ping(self):
         self.client.meta()
 
-    def chat(self, question):
-        result = self.client(
-            self.compile_conversation(question), **self.chat_request_args()
-        )
+    def chat(self, question, on_text=None):
+        prompt = self.compile_conversation(question)
+        if on_text is None:
+            result = self.client(prompt, **self.chat_request_args())
+        else:
+            result = self.client.stream(prompt, on_text, **self.chat_request_args())
         answer = result["generated"]
         self.add_chat(question, answer)
         return result
@@ -223,13 +225,21 @@ class ChatClient:
                     print(f"--- unknown command '{command}' ---")
                 continue
             chat_print(self.get_assistant_prompt(for_print=True).removeprefix("\n"))
-            result = self.chat(question)
+            streamed = []
+
+            def on_text(text):
+                streamed.append(text)
+                chat_print(text, flush=True)
+
+            result = self.chat(question, on_text=on_text)
             stopping_reason = result["stopping_reason"]
             if stopping_reason is None:
                 stopping_reason = f"stop token generated or token limit reached"
             elif isinstance(stopping_reason, str):
                 stopping_reason = f"'{stopping_reason}'"
             answer = result["generated"]
+            streamed = "".join(streamed)
+            answer = answer[len(streamed) :] if answer.startswith(streamed) else ""
             sizes = result["size"]
             input_size = sizes["input"]
             output_size = sizes["output"]
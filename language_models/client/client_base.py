@@ -1,6 +1,10 @@
+from threading import Lock
+
 import requests
+from requests.adapters import HTTPAdapter
 
-from .hosts import find_host
+from .hosts import ThreadWithReturnValue, get_replica_set
+from .tokenizer import LocalTokenizer
 
 
 class LLMError(Exception):
@@ -19,21 +23,101 @@ class UserError(LLMError):
     pass
 
 
+class OverloadedError(LLMError):
+    def __init__(self, retry_after, *args, **kwargs):
+        self.retry_after = retry_after
+        super().__init__(*args, **kwargs)
+
+
+class ExpiredError(LLMError):
+    pass
+
+
+def merge_results(results):
+    merged = dict(results[0])
+    merged["data"] = [element for result in results for element in result["data"]]
+    timings = [result["meta"].get("timing") for result in results]
+    if all(timing is not None for timing in timings):
+        merged["meta"] = results[0]["meta"] | {
+            "timing": {
+                "elements": [
+                    element for timing in timings for element in timing["elements"]
+                ]
+            }
+        }
+    return merged
+
+
+_local_tokenizers = {}
+_local_tokenizers_lock = Lock()
+
+
+def pooled_session(pool_size):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
 class ClientBase:
-    def __init__(self, model, host):
+    def __init__(
+        self,
+        model,
+        host,
+        priority=None,
+        client_id=None,
+        min_shard_size=1,
+        pool_size=16,
+        timeout=None,
+        server_timeout=None,
+        local_tokenizer=True,
+    ):
         self.model = model
+        self.local_tokenizer = local_tokenizer
+        self._meta = None
+        self.min_shard_size = min_shard_size
+        self.timeout = timeout
+        self.session = pooled_session(pool_size)
+        self.replicas = None
+        self.headers = {}
+        if priority is not None:
+            self.headers["X-Priority"] = priority
+        if client_id is not None:
+            self.headers["X-Client-Id"] = client_id
+        if server_timeout is not None:
+            self.headers["X-Timeout"] = str(server_timeout)
         if isinstance(host, str):
-            self.host = host
+            self._host = host
         elif isinstance(host, (list, tuple)):
-            self.host = find_host(model, host)
+            self.replicas = get_replica_set(model, host)
         else:
             raise ValueError("host has to be string or list")
 
+    @property
+    def host(self):
+        if self.replicas is None:
+            return self._host
+        return self.replicas.select()
+
+    def _request_headers(self, with_meta=False):
+        if with_meta:
+            return {**self.headers, "X-Timing": "1"}
+        return self.headers
+
     def _verify(self, response):
-        result = response.json()
+        return self._verify_result(response.json())
+
+    def _verify_result(self, result):
         if not result["success"]:
             if result["error"] == "USER":
                 raise UserError(result["meta"], result["message"])
+            elif result["error"] == "OVERLOADED":
+                raise OverloadedError(
+                    result["retry_after"], result["meta"], result["message"]
+                )
+            elif result["error"] == "EXPIRED":
+                raise ExpiredError(result["meta"], result["message"])
             elif "errors" in result:
                 raise ServerError(
                     result["errors"],
@@ -49,27 +133,100 @@ class ClientBase:
             )
         return result
 
+    def _request(self, method, url, *args, size=0, **kwargs):
+        kwargs.setdefault("headers", self.headers)
+        kwargs.setdefault("timeout", self.timeout)
+
+        def request(host):
+            return self._verify(
+                self.session.request(method, f"{host}{url}", *args, **kwargs)
+            )
+
+        if self.replicas is None:
+            return request(self.host)
+        return self.replicas.call(
+            request,
+            size,
+            retry_on=(OverloadedError,),
+        )
+
     def _get(self, url, *args, data_only=True, **kwargs):
-        result = self._verify(requests.get(f"{self.host}{url}", *args, **kwargs))
+        result = self._request("GET", url, *args, **kwargs)
         if data_only:
             return result["data"]
         return result
 
     def _post(self, url, *args, data_only=True, **kwargs):
-        result = self._verify(requests.post(f"{self.host}{url}", *args, **kwargs))
+        result = self._request("POST", url, *args, **kwargs)
         if data_only:
             return result["data"]
         return result
 
+    def _shards(self, size):
+        if self.replicas is None:
+            return [(0, size)]
+        return self.replicas.shard(size, self.min_shard_size)
+
+    def _post_batch(self, url, arguments, **kwargs):
+        batch = arguments["batch"]
+        threads = [
+            ThreadWithReturnValue(
+                target=self._post,
+                args=(url,),
+                kwargs={
+                    "json": {**arguments, "batch": batch[start:end]},
+                    "data_only": False,
+                    "size": end - start,
+                    **kwargs,
+                },
+            )
+            for start, end in self._shards(len(batch))
+        ]
+        if len(threads) == 1:
+            (thread,) = threads
+            thread.run()
+            return thread.finish()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return merge_results([thread.finish() for thread in threads])
+
     def meta(self):
-        return self._get("/health", data_only=False)["meta"]
+        if self._meta is None:
+            self._meta = self._get("/health", data_only=False)["meta"]
+        return self._meta
+
+    def tokenizer(self):
+        if not self.local_tokenizer:
+            return None
+        with _local_tokenizers_lock:
+            if self.model not in _local_tokenizers:
+                definition = self._get("/tokenizer")["definition"]
+                _local_tokenizers[self.model] = (
+                    None if definition is None else LocalTokenizer(definition)
+                )
+            return _local_tokenizers[self.model]
 
     def count_tokens(self, text, indicate_shared=False, data_only=True):
+        tokenizer = self.tokenizer() if data_only else None
+        if tokenizer is not None:
+            return tokenizer.count_tokens(text, indicate_shared)
         return self._post(
             "/tokenizer/count",
             json={"text": text, "indicate_shared": indicate_shared},
             data_only=data_only,
         )
 
+    def count_tokens_batch(self, texts, indicate_shared=False, data_only=True):
+        tokenizer = self.tokenizer() if data_only else None
+        if tokenizer is not None:
+            return tokenizer.count_tokens_batch(texts, indicate_shared)
+        return self._post(
+            "/tokenizer/count/batch",
+            json={"texts": texts, "indicate_shared": indicate_shared},
+            data_only=data_only,
+        )
+
     def __call__(self, *args, **kwargs):
         raise NotImplementedError
@@ -1,5 +1,5 @@
 import random
-from threading import Thread
+from threading import Event, Lock, Thread
 
 import requests
 
@@ -60,3 +60,162 @@ def find_host(model, hosts, select_random=True):
     else:
         (host,) = valid
     return host
+
+
+def check_replica(session, host, timeout):
+    try:
+        response = session.get(f"{host}/statistics", timeout=timeout)
+        result = response.json()
+    except (requests.exceptions.RequestException, ValueError):
+        return None
+    if not result["success"]:
+        return None
+    statistics = result["data"]
+    load = statistics.get("waiting elements", 0) + statistics.get("running elements", 0)
+    return result["meta"]["model"], load
+
+
+class ReplicaSet:
+    def __init__(self, model, hosts, poll_interval=5.0, timeout=5.0):
+        self.model = model
+        self.hosts = [host for host in hosts if host.startswith("http")]
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+        self.loads = {}
+        self.in_flight = {host: 0 for host in self.hosts}
+        self.lock = Lock()
+        self.stopped = Event()
+        self.session = requests.Session()
+        found = self.refresh()
+        if not self.loads:
+            raise ValueError(
+                f"none of the configured hosts is running '{model}', found: {found}"
+            )
+        self.poller = Thread(target=self._poll, daemon=True)
+        self.poller.start()
+
+    def __len__(self):
+        return len(self.loads)
+
+    def refresh(self):
+        threads = [
+            ThreadWithReturnValue(
+                target=check_replica, args=(self.session, host, self.timeout)
+            )
+            for host in self.hosts
+        ]
+        for thread in threads:
+            thread.start()
+        found = []
+        loads = {}
+        for host, thread in zip(self.hosts, threads):
+            thread.join()
+            result = thread.finish()
+            if result is None:
+                continue
+            server_model, load = result
+            found.append((host, server_model))
+            if server_model == self.model:
+                loads[host] = load
+        with self.lock:
+            self.loads = loads
+        return found
+
+    def _poll(self):
+        while not self.stopped.wait(self.poll_interval):
+            self.refresh()
+
+    def close(self):
+        self.stopped.set()
+
+    def _load(self, host):
+        return self.loads[host] + self.in_flight[host]
+
+    def select(self, exclude=()):
+        with self.lock:
+            hosts = [host for host in self.loads if host not in exclude]
+            if not hosts:
+                return None
+            return min(hosts, key=self._load)
+
+    def acquire(self, size, exclude=()):
+        with self.lock:
+            hosts = [host for host in self.loads if host not in exclude]
+            if not hosts:
+                return None
+            host = min(hosts, key=self._load)
+            self.in_flight[host] += size
+            return host
+
+    def release(self, host, size):
+        with self.lock:
+            self.in_flight[host] -= size
+
+    def mark_unavailable(self, host):
+        with self.lock:
+            self.loads.pop(host, None)
+
+    def _next(self, size, tried, error):
+        host = self.acquire(size, exclude=tried)
+        if host is None:
+            if error is None:
+                raise ValueError(f"no replica of '{self.model}' is available")
+            raise error
+        return host
+
+    def call(
+        self,
+        function,
+        size=0,
+        retry_on=(),
+        unavailable_on=(requests.exceptions.ConnectionError,),
+    ):
+        tried = set()
+        error = None
+        while True:
+            host = self._next(size, tried, error)
+            try:
+                return function(host)
+            except unavailable_on as e:
+                self.mark_unavailable(host)
+                error = e
+            except retry_on as e:
+                error = e
+            finally:
+                self.release(host, size)
+            tried.add(host)
+
+    async def acall(self, function, size=0, retry_on=(), unavailable_on=()):
+        tried = set()
+        error = None
+        while True:
+            host = self._next(size, tried, error)
+            try:
+                return await function(host)
+            except unavailable_on as e:
+                self.mark_unavailable(host)
+                error = e
+            except retry_on as e:
+                error = e
+            finally:
+                self.release(host, size)
+            tried.add(host)
+
+    def shard(self, size, min_shard_size=1):
+        num_shards = max(1, min(len(self), size // min_shard_size))
+        bounds = [round(i * size / num_shards) for i in range(num_shards + 1)]
+        return list(zip(bounds, bounds[1:]))
+
+
+_replica_sets = {}
+_replica_sets_lock = Lock()
+
+
+def get_replica_set(model, hosts, **kwargs):
+    key = (model, tuple(hosts))
+    with _replica_sets_lock:
+        try:
+            return _replica_sets[key]
+        except KeyError:
+            replica_set = _replica_sets[key] = ReplicaSet(model, hosts, **kwargs)
+            return replica_set
@@ -1,7 +1,27 @@
+import json
+
 from .client_base import ClientBase
 
 
+def iter_events(response):
+    event = None
+    for line in response.iter_lines(decode_unicode=True):
+        if line.startswith("event: "):
+            event = line.removeprefix("event: ")
+        elif line.startswith("data: "):
+            yield event, json.loads(line.removeprefix("data: "))
+            event = None
+
+
 class LLMClient(ClientBase):
+    def _arguments(self, batch, max_new_tokens, stopping_strings):
+        args = {"batch": batch}
+        if max_new_tokens is not None:
+            args["max_new_tokens"] = max_new_tokens
+        if stopping_strings is not None:
+            args["stopping_strings"] = stopping_strings
+        return args
+
     def __call__(
         self,
         batch,
@@ -13,12 +33,97 @@ class LLMClient(ClientBase):
         is_single = not isinstance(batch, list)
         if is_single:
             batch = [batch]
-        args = {"batch": batch}
-        if max_new_tokens is not None:
-            args["max_new_tokens"] = max_new_tokens
-        if stopping_strings is not None:
-            args["stopping_strings"] = stopping_strings
-        result = self._post("/", json=args, data_only=False)
+        args = self._arguments(batch, max_new_tokens, stopping_strings)
+        result = self._post_batch("/", args, headers=self._request_headers(with_meta))
+        return self._unpack(result, is_single, raise_overflow, with_meta)
+
+    def _trim_arguments(
+        self,
+        template,
+        segments,
+        instruction,
+        max_length,
+        max_new_tokens,
+        stopping_strings,
+    ):
+        args = self._arguments(None, max_new_tokens, stopping_strings)
+        del args["batch"]
+        args["template"] = template
+        args["segments"] = segments
+        if instruction is not None:
+            args["instruction"] = instruction
+        if max_length is not None:
+            args["max_length"] = int(max_length)
+        return args
+
+    def generate_trimmed(
+        self,
+        template,
+        segments,
+        instruction=None,
+        max_length=None,
+        max_new_tokens=None,
+        stopping_strings=None,
+        raise_overflow=True,
+        with_meta=False,
+    ):
+        args = self._trim_arguments(
+            template,
+            segments,
+            instruction,
+            max_length,
+            max_new_tokens,
+            stopping_strings,
+        )
+        result = self._post(
+            "/trimmed",
+            json=args,
+            data_only=False,
+            size=1,
+            headers=self._request_headers(with_meta),
+        )
+        generated = self._unpack(result, True, raise_overflow, False)
+        generated = generated | {"segments_used": result["meta"]["segments_used"]}
+        if with_meta:
+            return generated, result["meta"]
+        return generated
+
+    def stream(
+        self,
+        batch,
+        on_text,
+        max_new_tokens=None,
+        stopping_strings=None,
+        raise_overflow=True,
+        with_meta=False,
+    ):
+        is_single = not isinstance(batch, list)
+        if is_single:
+            batch = [batch]
+        args = self._arguments(batch, max_new_tokens, stopping_strings)
+        with self.session.post(
+            f"{self.host}/stream",
+            timeout=self.timeout,
+            json=args,
+            headers=self._request_headers(with_meta),
+            stream=True,
+        ) as response:
+            if not response.headers["content-type"].startswith("text/event-stream"):
+                self._verify(response)
+                raise ValueError("the server did not answer with an event stream")
+            result = None
+            for event, data in iter_events(response):
+                if event == "result":
+                    result = self._verify_result(data)
+                elif is_single:
+                    on_text(data["text"])
+                else:
+                    on_text(data["index"], data["text"])
+        if result is None:
+            raise ValueError("the stream ended without a result")
+        return self._unpack(result, is_single, raise_overflow, with_meta)
+
+    def _unpack(self, result, is_single, raise_overflow, with_meta):
         generated = []
         for element in result["data"]:
             if raise_overflow:
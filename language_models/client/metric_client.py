@@ -2,22 +2,29 @@ from .client_base import ClientBase
 
 
 class MetricClient(ClientBase):
-    def __call__(
-        self,
-        batch,
-        select=None,
-        with_meta=False,
-    ):
-        is_single = not isinstance(batch, list)
-        if is_single:
-            batch = [batch]
+    def _arguments(self, batch, select):
         args = {"batch": batch}
         if select is not None:
             args["select"] = select
-        result = self._post("/", json=args, data_only=False)
+        return args
+
+    def _unpack(self, result, is_single, with_meta):
         scores = result["data"]
         if is_single:
             (scores,) = scores
         if with_meta:
             return scores, result["meta"]
         return scores
+
+    def __call__(
+        self,
+        batch,
+        select=None,
+        with_meta=False,
+    ):
+        is_single = not isinstance(batch, list)
+        if is_single:
+            batch = [batch]
+        args = self._arguments(batch, select)
+        result = self._post_batch("/", args, headers=self._request_headers(with_meta))
+        return self._unpack(result, is_single, with_meta)
@@ -0,0 +1,206 @@
+import asyncio
+import json
+from queue import Queue
+from threading import Thread
+
+import websockets
+
+from .client_base import ClientBase
+from .language_model_client import LLMClient
+from .metric_client import MetricClient
+
+
+class WebsocketClientBase(ClientBase):
+    def __init__(self, *args, max_in_flight=32, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.max_in_flight = max_in_flight
+
+    def _websocket_url(self):
+        return "ws" + self.host.removeprefix("http") + "/websocket"
+
+    async def _aiter_requests(self, requests, with_meta=False, completion_order=False):
+        headers = self._request_headers(with_meta)
+        if completion_order:
+            headers = {**headers, "X-Response-Order": "completion"}
+        async with websockets.connect(
+            self._websocket_url(), additional_headers=headers, max_size=None
+        ) as websocket:
+            in_flight = asyncio.Semaphore(self.max_in_flight)
+
+            async def send():
+                for request in requests:
+                    await in_flight.acquire()
+                    await websocket.send(json.dumps(request))
+
+            sender = asyncio.ensure_future(send())
+            try:
+                for i in range(len(requests)):
+                    payload = json.loads(await websocket.recv())
+                    in_flight.release()
+                    if completion_order:
+                        i = payload.pop("index")
+                    yield i, self._verify_result(payload)
+                await sender
+            finally:
+                sender.cancel()
+
+    def _iter_requests(self, requests, with_meta=False, completion_order=False):
+        results = Queue()
+
+        async def pump():
+            async for result in self._aiter_requests(
+                requests, with_meta, completion_order
+            ):
+                results.put((True, result))
+
+        def run():
+            try:
+                asyncio.run(pump())
+                results.put((False, None))
+            except Exception as e:
+                results.put((False, e))
+
+        thread = Thread(target=run, daemon=True)
+        thread.start()
+        while True:
+            is_result, value = results.get()
+            if not is_result:
+                thread.join()
+                if value is not None:
+                    raise value
+                return
+            yield value
+
+    @staticmethod
+    def _elements(unpacked, with_meta):
+        if with_meta:
+            elements, meta = unpacked
+            return [(element, meta) for element in elements]
+        return unpacked
+
+    def _indexed_elements(self, index, unpacked, request_size, with_meta):
+        start = index * request_size
+        for i, element in enumerate(self._elements(unpacked, with_meta)):
+            yield start + i, element
+
+    def __call__(self, batch, *args, with_meta=False, **kwargs):
+        is_single = not isinstance(batch, list)
+        if is_single:
+            batch = [batch]
+        results = list(self.imap(batch, *args, with_meta=with_meta, **kwargs))
+        if with_meta:
+            meta = results[0][1] if results else None
+            results = [result for result, _ in results]
+        if is_single:
+            (results,) = results
+        if with_meta:
+            return results, meta
+        return results
+
+    def _requests(self, batch, request_size, *args):
+        return [
+            self._arguments(batch[i : i + request_size], *args)
+            for i in range(0, len(batch), request_size)
+        ]
+
+
+class WebsocketLLMClient(WebsocketClientBase, LLMClient):
+    def imap(
+        self,
+        batch,
+        max_new_tokens=None,
+        stopping_strings=None,
+        raise_overflow=True,
+        with_meta=False,
+        request_size=1,
+    ):
+        requests = self._requests(batch, request_size, max_new_tokens, stopping_strings)
+        for _, result in self._iter_requests(requests, with_meta):
+            yield from self._elements(
+                self._unpack(result, False, raise_overflow, with_meta), with_meta
+            )
+
+    def imap_unordered(
+        self,
+        batch,
+        max_new_tokens=None,
+        stopping_strings=None,
+        raise_overflow=True,
+        with_meta=False,
+        request_size=1,
+    ):
+        requests = self._requests(batch, request_size, max_new_tokens, stopping_strings)
+        for index, result in self._iter_requests(requests, with_meta, True):
+            yield from self._indexed_elements(
+                index,
+                self._unpack(result, False, raise_overflow, with_meta),
+                request_size,
+                with_meta,
+            )
+
+    async def aimap(
+        self,
+        batch,
+        max_new_tokens=None,
+        stopping_strings=None,
+        raise_overflow=True,
+        with_meta=False,
+        request_size=1,
+    ):
+        requests = self._requests(batch, request_size, max_new_tokens, stopping_strings)
+        async for _, result in self._aiter_requests(requests, with_meta):
+            for element in self._elements(
+                self._unpack(result, False, raise_overflow, with_meta), with_meta
+            ):
+                yield element
+
+    async def aimap_unordered(
+        self,
+        batch,
+        max_new_tokens=None,
+        stopping_strings=None,
+        raise_overflow=True,
+        with_meta=False,
+        request_size=1,
+    ):
+        requests = self._requests(batch, request_size, max_new_tokens, stopping_strings)
+        async for index, result in self._aiter_requests(requests, with_meta, True):
+            for element in self._indexed_elements(
+                index,
+                self._unpack(result, False, raise_overflow, with_meta),
+                request_size,
+                with_meta,
+            ):
+                yield element
+
+
+class WebsocketMetricClient(WebsocketClientBase, MetricClient):
+    def imap(self, batch, select=None, with_meta=False, request_size=1):
+        requests = self._requests(batch, request_size, select)
+        for _, result in self._iter_requests(requests, with_meta):
+            yield from self._elements(self._unpack(result, False, with_meta), with_meta)
+
+    def imap_unordered(self, batch, select=None, with_meta=False, request_size=1):
+        requests = self._requests(batch, request_size, select)
+        for index, result in self._iter_requests(requests, with_meta, True):
+            yield from self._indexed_elements(
+                index, self._unpack(result, False, with_meta), request_size, with_meta
+            )
+
+    async def aimap(self, batch, select=None, with_meta=False, request_size=1):
+        requests = self._requests(batch, request_size, select)
+        async for _, result in self._aiter_requests(requests, with_meta):
+            for element in self._elements(
+                self._unpack(result, False, with_meta), with_meta
+            ):
+                yield element
+
+    async def aimap_unordered(
+        self, batch, select=None, with_meta=False, request_size=1
+    ):
+        requests = self._requests(batch, request_size, select)
+        async for index, result in self._aiter_requests(requests, with_meta, True):
+            for element in self._indexed_elements(
+                index, self._unpack(result, False, with_meta), request_size, with_meta
+            ):
+                yield element
@@ -1,4 +1,4 @@
-from client import LLMClient, OpenAIClient
+from client import AsyncLLMClient, LLMClient, OpenAIClient, WebsocketLLMClient
 
 from .template import Template
 
@@ -44,9 +44,7 @@ class Experiment:
             return f"{major}.{minor}"
         return major
 
-    def __call__(
-        self, input, format_items={}, ensure_complete=True, verbose=False, **kwargs
-    ):
+    def _prepare(self, input, format_items, ensure_complete, kwargs):
         client_kwargs = self.client_kwargs.copy()
         client_kwargs.update(kwargs)
         template = self.template.copy(ensure_complete=ensure_complete).format(
@@ -56,7 +54,9 @@ class Experiment:
             batch = (str(template), input)
         else:
             batch = str(template.format({"input": input}))
-        result, meta = self.client(batch, **client_kwargs, with_meta=True)
+        return batch, client_kwargs
+
+    def _finish(self, result, meta, verbose):
         generated = result["generated"]
         if verbose:
             size = result["size"]
@@ -73,12 +73,81 @@ class Experiment:
             generated = self.bias + generated
         return generated
 
+    def __call__(
+        self, input, format_items={}, ensure_complete=True, verbose=False, **kwargs
+    ):
+        batch, client_kwargs = self._prepare(
+            input, format_items, ensure_complete, kwargs
+        )
+        result, meta = self.client(batch, **client_kwargs, with_meta=True)
+        return self._finish(result, meta, verbose)
+
+    async def acall(
+        self, input, format_items={}, ensure_complete=True, verbose=False, **kwargs
+    ):
+        batch, client_kwargs = self._prepare(
+            input, format_items, ensure_complete, kwargs
+        )
+        result, meta = await self.client(batch, **client_kwargs, with_meta=True)
+        return self._finish(result, meta, verbose)
+
+    def imap(
+        self, inputs, format_items={}, ensure_complete=True, verbose=False, **kwargs
+    ):
+        prepared = [
+            self._prepare(input, format_items, ensure_complete, kwargs)
+            for input in inputs
+        ]
+        if not prepared:
+            return
+        if not hasattr(self.client, "imap"):
+            for batch, client_kwargs in prepared:
+                result, meta = self.client(batch, **client_kwargs, with_meta=True)
+                yield self._finish(result, meta, verbose)
+            return
+        batches = [batch for batch, _ in prepared]
+        _, client_kwargs = prepared[0]
+        for result, meta in self.client.imap(batches, **client_kwargs, with_meta=True):
+            yield self._finish(result, meta, verbose)
+
+    def imap_unordered(
+        self, inputs, format_items={}, ensure_complete=True, verbose=False, **kwargs
+    ):
+        if not hasattr(self.client, "imap_unordered"):
+            yield from enumerate(
+                self.imap(inputs, format_items, ensure_complete, verbose, **kwargs)
+            )
+            return
+        prepared = [
+            self._prepare(input, format_items, ensure_complete, kwargs)
+            for input in inputs
+        ]
+        if not prepared:
+            return
+        batches = [batch for batch, _ in prepared]
+        _, client_kwargs = prepared[0]
+        for i, (result, meta) in self.client.imap_unordered(
+            batches, **client_kwargs, with_meta=True
+        ):
+            yield i, self._finish(result, meta, verbose)
+
 
 class Experiments:
-    def __init__(self, experiments, host=None, api_key=None):
+    def __init__(
+        self,
+        experiments,
+        host=None,
+        api_key=None,
+        priority=None,
+        asynchronous=False,
+        websocket=False,
+    ):
         self.experiments = experiments
         self.host = host
         self.api_key = api_key
+        self.priority = priority
+        self.asynchronous = asynchronous
+        self.websocket = websocket
 
     def get_experiment_args(self, experiment):
         major, *minor = experiment.split(".")
@@ -107,7 +176,15 @@ class Experiments:
             client = OpenAIClient(
                 model=args["meta"]["model"].lower(), api_key=self.api_key
             )
+        elif self.asynchronous:
+            client = AsyncLLMClient(
+                model=name[0], host=self.host, priority=self.priority
+            )
+        elif self.websocket:
+            client = WebsocketLLMClient(
+                model=name[0], host=self.host, priority=self.priority
+            )
         else:
-            client = LLMClient(model=name[0], host=self.host)
+            client = LLMClient(model=name[0], host=self.host, priority=self.priority)
         experiment_kwargs.update(kwargs)
         return Experiment(client, name, **experiment_kwargs)
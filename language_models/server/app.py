@@ -16,8 +16,18 @@ model = Model()
 
 DEFAULT_SETTINGS = {
     "threads": 1,
+    "processes": 0,
     "batch_size": 8,
     "cache_size": 0,
+    "disk_cache_size": 0,
+    "continuous_batching": 0,
+    "prefix_cache_tokens": 0,
+    "token_budget": 0,
+    "max_waiting_requests": 0,
+    "max_waiting_elements": 0,
+    "max_queued_tokens": 0,
+    "reject_overflow": 0,
+    "target_latency_ms": 0,
 }
 
 try:
@@ -44,6 +54,9 @@ for key, value in DEFAULT_SETTINGS.items():
         print(f"{ENVIRONMENT_VARIABLE}: {new_value}")
         exit(1)
 
+for key in ["cache_path", "cache_warm_path"]:
+    SETTINGS[key] = environ.get(key.upper())
+
 from typing import List, Tuple
 
 from application import FuncFastAPI
@@ -1,19 +1,68 @@
 import asyncio
 import inspect
 import logging
+import time
+from pathlib import Path
+from typing import Any, List, Optional, Tuple
 
 from fastapi import APIRouter, FastAPI, Request, Response, WebSocket
 from fastapi.exceptions import HTTPException
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse
 from fastapi.routing import APIRoute
+from pydantic import BaseModel, create_model
 
+from controller import AdaptiveController
 from manager.request import RequestManager
+from manager.stream import StreamManager
 from manager.websocket import WebsocketManager
 from payload import exception_to_payload, processed_to_payload
+from pool import ProcessPool
+from scheduler import ContinuousScheduler
+from utils.disconnect import DisconnectMiddleware
 from workers import Workers
 
 uvicorn_logger = logging.getLogger("uvicorn")
 
+CACHE_PATH = Path(__file__).parent / "cache"
+
+
+class CacheSnapshotModel(BaseModel):
+    entries: List[Tuple[str, Any]]
+
+
+class TrimModel(BaseModel):
+    template: str
+    segments: List[str]
+    instruction: Optional[str] = None
+    max_length: Optional[int] = None
+
+    class Config:
+        extra = "forbid"
+
+
+def create_trim_validator(validator):
+    arguments = {
+        name: (
+            validator.__annotations__[name],
+            ... if field.required else field.default,
+        )
+        for name, field in validator.__fields__.items()
+        if name != "batch"
+    }
+    return create_model("TrimValidator", __base__=TrimModel, **arguments)
+
+
+class TimedJSONResponse(JSONResponse):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.headers["Server-Timing"] = f"serialize;dur={self.render_time * 1000:.3f}"
+
+    def render(self, content):
+        start = time.perf_counter()
+        body = super().render(content)
+        self.render_time = time.perf_counter() - start
+        return body
+
 
 class ResponseHandler:
     def __init__(self, model_name, *, extra_meta=None):
@@ -27,11 +76,21 @@ class ResponseHandler:
     def get_meta(self):
         return self._meta
 
-    def result_response(self, result_type, result, to_response):
+    def result_response(
+        self, result_type, result, to_response, timings=None, meta=None
+    ):
         payload, status_code = processed_to_payload(result_type, result)
         payload["meta"] = self.get_meta()
+        if meta is not None:
+            payload["meta"] = payload["meta"] | meta
+        if timings is not None:
+            payload["meta"] = payload["meta"] | {"timing": {"elements": timings}}
         if to_response:
-            return JSONResponse(payload, status_code=status_code)
+            headers = None
+            if "retry_after" in payload:
+                headers = {"Retry-After": str(payload["retry_after"])}
+            response_class = JSONResponse if timings is None else TimedJSONResponse
+            return response_class(payload, status_code=status_code, headers=headers)
         return payload
 
     def exception_response(self, exc, to_response):
@@ -79,11 +138,24 @@ class FuncFastAPI(FastAPI):
         *args,
         model_name=None,
         threads=1,
+        processes=0,
         batch_size=32,
         cache_size=0,
+        disk_cache_size=0,
+        cache_path=None,
+        cache_warm_path=None,
+        continuous_batching=False,
+        prefix_cache_tokens=0,
+        token_budget=0,
+        max_waiting_requests=0,
+        max_waiting_elements=0,
+        max_queued_tokens=0,
+        reject_overflow=False,
+        target_latency_ms=0,
         **kwargs,
     ):
         super().__init__(*args, **kwargs)
+        self.add_middleware(DisconnectMiddleware)
         if inspect.isfunction(function_or_object) or inspect.ismethod(
             function_or_object
         ):
@@ -99,10 +171,83 @@ class FuncFastAPI(FastAPI):
             route_class=response_handler.ExceptionHandlerRoute,
             default_response_class=response_handler.SuccessJSONResponse,
         )
+        if continuous_batching:
+            if not hasattr(function_or_object, "continuous_batch"):
+                raise ValueError(f"{model_name} does not support continuous batching")
+            scheduler = ContinuousScheduler(function_or_object, batch_size)
+        else:
+            scheduler = None
+        if prefix_cache_tokens > 0:
+            if not hasattr(function_or_object, "enable_prefix_cache"):
+                raise ValueError(f"{model_name} does not support prefix caching")
+            function_or_object.enable_prefix_cache(prefix_cache_tokens)
+        if processes > 0:
+            if continuous_batching:
+                raise ValueError(
+                    "continuous batching cannot be combined with worker processes"
+                )
+            if not hasattr(function_or_object, "enable_processes"):
+                raise ValueError(f"{model_name} does not support worker processes")
+            initializer = function_or_object.enable_processes(processes)
+            pool = ProcessPool(function, processes, initializer)
+        else:
+            pool = None
+        input_lengths = getattr(function_or_object, "input_lengths", None)
+        if token_budget > 0 and input_lengths is None:
+            raise ValueError(f"{model_name} does not support token budgets")
+        if max_queued_tokens > 0 and input_lengths is None:
+            raise ValueError(f"{model_name} does not support queued token limits")
+        max_input_length = 0
+        if input_lengths is not None and hasattr(
+            function_or_object, "max_input_length"
+        ):
+            max_input_length = function_or_object.max_input_length()
+        if reject_overflow and not max_input_length:
+            raise ValueError(f"{model_name} does not support rejecting overflows")
+        if target_latency_ms > 0:
+            if continuous_batching:
+                raise ValueError(
+                    "adaptive batching cannot be combined with continuous batching"
+                )
+            limits_tokens = input_lengths is not None and bool(
+                token_budget or max_input_length
+            )
+            if limits_tokens:
+                max_limit = token_budget or batch_size * max_input_length
+            else:
+                max_limit = batch_size
+            controller = AdaptiveController(
+                target_latency_ms / 1000,
+                max_limit,
+                processes or threads,
+                limits_tokens=limits_tokens,
+            )
+        else:
+            controller = None
+        if disk_cache_size > 0 and cache_path is None:
+            cache_path = CACHE_PATH / f"{model_name}.sqlite"
         self.workers = Workers(
-            function, num_threads=threads, batch_size=batch_size, cache_size=cache_size
+            function,
+            num_threads=threads,
+            batch_size=batch_size,
+            cache_size=cache_size,
+            disk_cache_size=disk_cache_size,
+            cache_path=cache_path,
+            cache_warm_path=cache_warm_path,
+            scheduler=scheduler,
+            pool=pool,
+            controller=controller,
+            memory_headroom=getattr(function_or_object, "memory_headroom", None),
+            input_lengths=input_lengths,
+            token_budget=token_budget,
+            max_waiting_requests=max_waiting_requests,
+            max_waiting_elements=max_waiting_elements,
+            max_queued_tokens=max_queued_tokens,
+            max_input_length=max_input_length,
+            reject_overflow=bool(reject_overflow),
         )
         self.model_name = model_name
+        trim_validator = create_trim_validator(validator)
 
         async def validate(_: validator):
             pass
@@ -112,6 +257,25 @@ class FuncFastAPI(FastAPI):
                 body.dict(), self.workers
             )
 
+        async def trimmed(body: trim_validator, request: Request):
+            arguments = body.dict()
+            trim = {key: arguments.pop(key) for key in TrimModel.__fields__}
+            prompt, segments_used = await asyncio.to_thread(
+                function_or_object.trim_prompt,
+                **trim,
+                max_new_tokens=arguments.get("max_new_tokens"),
+            )
+            return await RequestManager(request, response_handler).send_to_workers(
+                arguments | {"batch": [prompt]},
+                self.workers,
+                meta={"segments_used": segments_used},
+            )
+
+        async def stream(body: validator, request: Request):
+            return await StreamManager(request, response_handler).send_to_workers(
+                body.dict(), self.workers
+            )
+
         async def websocket(websocket: WebSocket):
             await WebsocketManager(
                 websocket, validator, response_handler
@@ -121,12 +285,29 @@ class FuncFastAPI(FastAPI):
             pass
 
         async def statistics():
-            return self.workers.statistics() | {
+            statistics = self.workers.statistics()
+            if hasattr(function_or_object, "statistics"):
+                statistics.update(function_or_object.statistics())
+            return statistics | {
                 "futures in event loop": len(
                     asyncio.all_tasks(asyncio.get_running_loop())
                 )
             }
 
+        async def metrics():
+            return PlainTextResponse(
+                self.workers.metrics.render(), media_type="text/plain; version=0.0.4"
+            )
+
+        async def cache_statistics():
+            return self.workers.cache.settings() | self.workers.cache.statistics()
+
+        async def cache_export():
+            return {"entries": self.workers.cache.export()}
+
+        async def cache_import(body: CacheSnapshotModel):
+            return {"loaded": self.workers.cache.load(body.entries)}
+
         _schema = validator.schema()
 
         async def schema():
@@ -137,9 +318,18 @@ class FuncFastAPI(FastAPI):
         self.on_event("shutdown")(self.workers.shutdown)
         self.api_router.post("/validate")(validate)
         self.api_router.post("/")(index)
+        if self.workers.supports_streaming:
+            self.api_router.post("/stream")(stream)
+        if hasattr(function_or_object, "trim_prompt"):
+            self.api_router.post("/trimmed")(trimmed)
         self.api_router.get("/health")(health)
         self.api_router.get("/statistics")(statistics)
+        self.api_router.get("/metrics")(metrics)
         self.api_router.get("/schema")(schema)
+        self.api_router.get("/cache/statistics")(cache_statistics)
+        if self.workers.cache.enabled:
+            self.api_router.get("/cache/export")(cache_export)
+            self.api_router.post("/cache/import")(cache_import)
         self.api_router.websocket("/websocket")(websocket)
         if hasattr(function_or_object, "router_hook"):
             function_or_object.router_hook(self.api_router)
@@ -40,6 +40,8 @@ def create_function_validator(
                     )
             pos_arguments[name] = (anno, ...)
     for name, p in param_iter:
+        if name.startswith("_"):
+            continue
         annotation = Any if p.annotation is p.empty else p.annotation
         default = ... if p.default is p.empty else p.default
         error = ARGUMENT_ERRORS[p.kind]
@@ -0,0 +1,84 @@
+import asyncio
+import importlib
+import random
+import time
+from os import environ
+
+from utils.cache import Cache
+from utils.event import EventBox
+from workers import Batcher, Work
+
+# run from the server directory with:
+# python -m benchmarks.batching
+# set LANGUAGE_MODEL to additionally measure the throughput of a generation model
+
+NUM_PROMPTS = 512
+BATCH_SIZE = 32
+TOKEN_BUDGET = 16384
+MIN_LENGTH = 30
+MAX_LENGTH = 2000
+
+
+def make_lengths(rng):
+    return [
+        min(MAX_LENGTH, max(MIN_LENGTH, int(rng.lognormvariate(5.5, 1.0))))
+        for _ in range(NUM_PROMPTS)
+    ]
+
+
+async def form_batches(prompts, lengths, batch_size, token_budget, sort):
+    batcher = Batcher(batch_size, token_budget=token_budget)
+    event_box = EventBox(asyncio.Event(), None)
+    input_lengths = (lambda batch: [lengths[e] for e in batch]) if sort else None
+    work = Work(event_box, {"batch": prompts}, Cache(0), input_lengths=input_lengths)
+    batcher.add(work)
+    batches = []
+    async for _, batch in batcher.consume():
+        batches.append(batch["batch"])
+        if not batcher.num_waiting_elements():
+            break
+    return batches
+
+
+def report(name, batches, lengths, elapsed=None):
+    tokens = sum(lengths[e] for batch in batches for e in batch)
+    padded = sum(max(lengths[e] for e in batch) * len(batch) for batch in batches)
+    largest = max(max(lengths[e] for e in batch) * len(batch) for batch in batches)
+    line = (
+        f"{name:>14}: {len(batches):>4} batches, {padded:>8} padded tokens, "
+        f"{1 - tokens / padded:6.1%} padding, largest batch {largest:>6} tokens"
+    )
+    if elapsed is not None:
+        line += f", {sum(len(b) for b in batches) / elapsed:7.2f} prompts/s"
+    print(line)
+
+
+def measure(model, batches, texts):
+    start = time.perf_counter()
+    for batch in batches:
+        model([texts[e] for e in batch], max_new_tokens=1, stopping_strings=None)
+    return time.perf_counter() - start
+
+
+async def main():
+    rng = random.Random(0)
+    lengths = make_lengths(rng)
+    prompts = list(range(NUM_PROMPTS))
+    model = texts = None
+    if "LANGUAGE_MODEL" in environ:
+        model = importlib.import_module(f"models.{environ['LANGUAGE_MODEL']}").Model()
+        texts = [" the" * length for length in lengths]
+        max_length = model.max_input_length()
+        lengths = [min(length, max_length) for length in model.input_lengths(texts)]
+    for name, token_budget, sort in [
+        ("count", 0, False),
+        ("sorted", 0, True),
+        ("token budget", TOKEN_BUDGET, True),
+    ]:
+        batches = await form_batches(prompts, lengths, BATCH_SIZE, token_budget, sort)
+        elapsed = None if model is None else measure(model, batches, texts)
+        report(name, batches, lengths, elapsed)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,92 @@
+import random
+import string
+import time
+
+from models._stopping_criteria import StringStoppingCriteria
+
+# run from the server directory with:
+# python -m benchmarks.stop_strings
+
+NUM_TOKENS = 20000
+NUM_RUNS = 5
+
+
+class LegacyStringStoppingCriteria:
+    def __init__(self, inclusive, exclusive):
+        self.inclusive = inclusive
+        self.exclusive = exclusive
+        self.decoded = ""
+        self.stop_string = None
+
+    def _contains_stop_string(self, stop_set, token, remove):
+        for string in stop_set:
+            lookback = len(string) + len(token) - 1
+            if string in self.decoded[-lookback:]:
+                self.stop_string = string
+                self.remove = remove
+                return True
+
+    def should_stop(self, token):
+        self.decoded += token
+        return self._contains_stop_string(
+            self.exclusive, token, True
+        ) or self._contains_stop_string(self.inclusive, token, False)
+
+
+def random_word(rng, min_length, max_length):
+    length = rng.randint(min_length, max_length)
+    return "".join(rng.choices(string.ascii_lowercase, k=length))
+
+
+def make_stop_strings(rng, num_stop_strings):
+    stop_strings = {f"<|{random_word(rng, 3, 8)}|>" for _ in range(num_stop_strings)}
+    exclusive = set(list(stop_strings)[::2])
+    return stop_strings - exclusive, exclusive
+
+
+def make_tokens(rng, num_tokens):
+    alphabet = string.ascii_lowercase + " <|>"
+    return [
+        "".join(rng.choices(alphabet, k=rng.randint(1, 6))) for _ in range(num_tokens)
+    ]
+
+
+def run(criteria, tokens):
+    start = time.perf_counter()
+    for i, token in enumerate(tokens):
+        if criteria.should_stop(token):
+            break
+    return time.perf_counter() - start, i
+
+
+def benchmark(num_stop_strings, rng):
+    inclusive, exclusive = make_stop_strings(rng, num_stop_strings)
+    tokens = make_tokens(rng, NUM_TOKENS)
+    legacy_time = new_time = 0
+    for _ in range(NUM_RUNS):
+        elapsed, legacy_stop = run(
+            LegacyStringStoppingCriteria(inclusive, exclusive), tokens
+        )
+        legacy_time += elapsed
+        elapsed, new_stop = run(
+            StringStoppingCriteria(None, inclusive=inclusive, exclusive=exclusive),
+            tokens,
+        )
+        new_time += elapsed
+        if legacy_stop != new_stop:
+            raise ValueError(
+                f"implementations disagree: stopped at {legacy_stop} and {new_stop}"
+            )
+    per_token = 1e6 / (NUM_RUNS * (legacy_stop + 1))
+    print(
+        f"{num_stop_strings:>4} stop strings, {legacy_stop + 1:>6} tokens: "
+        f"legacy {legacy_time * per_token:7.2f}us/token, "
+        f"automaton {new_time * per_token:7.2f}us/token, "
+        f"speedup {legacy_time / new_time:5.1f}x"
+    )
+
+
+if __name__ == "__main__":
+    rng = random.Random(0)
+    for num_stop_strings in [1, 10, 100]:
+        benchmark(num_stop_strings, rng)
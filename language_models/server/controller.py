@@ -0,0 +1,104 @@
+import math
+from collections import deque
+
+
+class AdaptiveController:
+    def __init__(
+        self,
+        target_latency,
+        max_limit,
+        max_concurrency,
+        limits_tokens=False,
+        window=32,
+        interval=8,
+        min_headroom=0.1,
+        slack=0.8,
+    ):
+        assert target_latency > 0, "the target latency has to be positive"
+        assert max_limit > 0, "the batch limit has to be at least 1"
+        assert max_concurrency > 0, "the concurrency has to be at least 1"
+        self.target_latency = target_latency
+        self.max_limit = max_limit
+        self.max_concurrency = max_concurrency
+        self.limits_tokens = limits_tokens
+        self.limit = max_limit
+        self.concurrency = max_concurrency
+        self.step = max(1, max_limit // 16)
+        self.latencies = deque(maxlen=window)
+        self.used = deque(maxlen=window)
+        self.interval = interval
+        self.min_headroom = min_headroom
+        self.slack = slack
+        self.num_increases = 0
+        self.num_decreases = 0
+        self.last_decision = None
+
+    def settings(self):
+        return {
+            "target latency ms": round(self.target_latency * 1000),
+            "adaptive limit": "tokens" if self.limits_tokens else "elements",
+            "max batch limit": self.max_limit,
+            "max concurrency": self.max_concurrency,
+        }
+
+    def statistics(self):
+        return {
+            "batch limit": self.limit,
+            "concurrency": self.concurrency,
+            "p95 batch seconds": round(self.p95(), 4),
+            "adaptive increases": self.num_increases,
+            "adaptive decreases": self.num_decreases,
+            "last adaptive decision": self.last_decision,
+        }
+
+    def p95(self):
+        if not self.latencies:
+            return 0.0
+        ordered = sorted(self.latencies)
+        return ordered[math.ceil(0.95 * len(ordered)) - 1]
+
+    def observe(self, elapsed, used, backlog, headroom=None):
+        self.latencies.append(elapsed)
+        self.used.append(used)
+        if len(self.latencies) < self.interval:
+            return False
+        p95 = self.p95()
+        low_memory = headroom is not None and headroom < self.min_headroom
+        if p95 > self.target_latency or low_memory:
+            changed = self._decrease(p95)
+        elif p95 < self.slack * self.target_latency and backlog:
+            changed = self._increase()
+        else:
+            changed = False
+        if changed:
+            self.latencies.clear()
+            self.used.clear()
+        return changed
+
+    def _decrease(self, p95):
+        if self.concurrency > 1:
+            self.concurrency -= 1
+            self.last_decision = f"concurrency decreased to {self.concurrency}"
+        elif self.limit > 1:
+            factor = 0.5
+            if p95 > self.target_latency:
+                factor = max(factor, self.target_latency / p95)
+            limit = min(self.limit, max(self.used))
+            self.limit = max(1, int(limit * factor))
+            self.last_decision = f"batch limit decreased to {self.limit}"
+        else:
+            return False
+        self.num_decreases += 1
+        return True
+
+    def _increase(self):
+        if self.limit < self.max_limit:
+            self.limit = min(self.max_limit, self.limit + self.step)
+            self.last_decision = f"batch limit increased to {self.limit}"
+        elif self.concurrency < self.max_concurrency:
+            self.concurrency += 1
+            self.last_decision = f"concurrency increased to {self.concurrency}"
+        else:
+            return False
+        self.num_increases += 1
+        return True
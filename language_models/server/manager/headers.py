@@ -0,0 +1,12 @@
+def scheduling_arguments(connection):
+    headers = connection.headers
+    client = headers.get("x-client-id")
+    if client is None and connection.client is not None:
+        client = connection.client.host
+    return {
+        "priority": headers.get("x-priority"),
+        "client": client,
+        "timing": headers.get("x-timing", "").lower() in ("1", "true"),
+        "timeout": headers.get("x-timeout"),
+        "deadline": headers.get("x-deadline"),
+    }
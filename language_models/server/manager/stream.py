@@ -0,0 +1,58 @@
+import asyncio
+import json
+
+from fastapi.responses import StreamingResponse
+
+from manager.headers import scheduling_arguments
+from utils.event import EventBox
+
+
+def to_event(data, event=None):
+    lines = [] if event is None else [f"event: {event}"]
+    lines.append(f"data: {json.dumps(data)}")
+    return "\n".join(lines) + "\n\n"
+
+
+class StreamManager:
+    def __init__(self, request, response_handler):
+        self.request = request
+        self.disconnect_event = asyncio.Event()
+        self.response_handler = response_handler
+        self.deltas = asyncio.Queue()
+
+    def add_delta(self, index, text):
+        self.deltas.put_nowait({"index": index, "text": text})
+
+    async def _events(self, event_box):
+        finished = asyncio.ensure_future(event_box.wait())
+        try:
+            while not finished.done():
+                delta = asyncio.ensure_future(self.deltas.get())
+                await asyncio.wait(
+                    [delta, finished], return_when=asyncio.FIRST_COMPLETED
+                )
+                if delta.done():
+                    yield to_event(delta.result())
+                else:
+                    delta.cancel()
+            while not self.deltas.empty():
+                yield to_event(self.deltas.get_nowait())
+            payload = event_box.make_response(to_response=False)
+            yield to_event(payload, event="result")
+        finally:
+            finished.cancel()
+            self.disconnect_event.set()
+
+    async def send_to_workers(self, data, workers):
+        event_box = EventBox(self.disconnect_event, self.response_handler)
+        workers.submit(
+            event_box,
+            data,
+            stream=self.add_delta,
+            **scheduling_arguments(self.request),
+        )
+        if event_box.is_overloaded():
+            return event_box.make_response(to_response=True)
+        return StreamingResponse(
+            self._events(event_box), media_type="text/event-stream"
+        )
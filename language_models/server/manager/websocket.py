@@ -1,18 +1,22 @@
 import asyncio
 
 from fastapi import WebSocketDisconnect
+from manager.headers import scheduling_arguments
 from starlette.websockets import WebSocketState
-
 from utils.aio import parallel, to_future
 from utils.event import EventBox
-from utils.pipe import SortedPipe
+from utils.pipe import Pipe, SortedPipe
 
 
 class WebsocketManager:
     def __init__(self, websocket, validator, response_handler):
         self.websocket = websocket
         self.validator = validator
-        self.pipe = SortedPipe()
+        self.completion_order = (
+            websocket.headers.get("x-response-order", "").lower() == "completion"
+        )
+        self.pipe = Pipe() if self.completion_order else SortedPipe()
+        self.request_count = 0
         self.disconnect_event = asyncio.Event()
         self.response_handler = response_handler
 
@@ -22,13 +26,19 @@ class WebsocketManager:
     async def send(self, data):
         await self.websocket.send_json(data)
 
+    def _add(self, index, payload):
+        if self.completion_order:
+            self.pipe.add(payload | {"index": index})
+        else:
+            self.pipe.add(index, payload)
+
     @to_future
     async def _send_to_workers(self, index, data, workers):
         event_box = EventBox(self.disconnect_event, self.response_handler)
-        workers.submit(event_box, data)
+        workers.submit(event_box, data, **scheduling_arguments(self.websocket))
         await event_box.wait()
-        payload, _ = event_box.make_response(to_reponse=False)
-        self.pipe.add(index, payload)
+        payload = event_box.make_response(to_response=False)
+        self._add(index, payload)
 
     async def _handle_responses(self):
         async for result in self.pipe.drain():
@@ -37,17 +47,18 @@ class WebsocketManager:
     async def _handle_requests(self, workers):
         while True:
             body = await self.websocket.receive_json()
-            index = self.pipe.next_index()
+            index = self.request_count
+            self.request_count += 1
             try:
                 body = self.validator(**body)
                 self._send_to_workers(index, body.dict(), workers)
             except (asyncio.CancelledError, SystemExit, KeyboardInterrupt):
                 raise
             except Exception as exc:
-                payload, _ = self.response_handler.exception_response(
+                payload = self.response_handler.exception_response(
                     exc, to_response=False
                 )
-                self.pipe.add(index, payload)
+                self._add(index, payload)
 
     async def loop_until_disconnect(self, workers):
         await self.websocket.accept()
@@ -0,0 +1,269 @@
+import inspect
+
+import torch
+import torch.nn.functional as F
+
+
+def to_legacy_cache(past_key_values):
+    if hasattr(past_key_values, "to_legacy_cache"):
+        return past_key_values.to_legacy_cache()
+    return past_key_values
+
+
+def pad_left(tensor, length, dim):
+    missing = length - tensor.size(dim)
+    if missing == 0:
+        return tensor
+    padding = [0, 0] * (tensor.dim() - dim - 1) + [missing, 0]
+    return F.pad(tensor, padding)
+
+
+class Sequence:
+    def __init__(
+        self,
+        stopping_criteria,
+        max_new_tokens,
+        num_input_tokens,
+        num_overflow_tokens,
+    ):
+        self.stopping_criteria = stopping_criteria
+        self.max_new_tokens = max_new_tokens
+        self.num_input_tokens = num_input_tokens
+        self.num_overflow_tokens = num_overflow_tokens
+        self.streamer = None
+        self.output = []
+        self.is_finished = False
+        self.entry = None
+
+    def add_token(self, token, eos_token_ids):
+        self.output.append(token)
+        if token in eos_token_ids or self.stopping_criteria.should_stop(token):
+            self.is_finished = True
+            return
+        if self.streamer is not None:
+            self.streamer.put(token)
+        if len(self.output) >= self.max_new_tokens:
+            self.is_finished = True
+
+
+class ContinuousBatch:
+    def __init__(self, model, eos_token_ids, prefix_cache=None):
+        self.model = model.model
+        self.tokenizer = model.tokenizer
+        self.is_cuda = model.is_cuda
+        self.eos_token_ids = eos_token_ids
+        self.accepts_position_ids = (
+            "position_ids" in inspect.signature(self.model.forward).parameters
+        )
+        self.prefix_cache = prefix_cache if self.accepts_position_ids else None
+        self.cache_class = None
+        self.sequences = []
+        self.input_ids = None
+        self.attention_mask = None
+        self.past_key_values = None
+
+    def __len__(self):
+        return len(self.sequences)
+
+    def _forward(self, input_ids, attention_mask, position_ids, past_key_values):
+        if past_key_values is not None and self.cache_class is not None:
+            past_key_values = self.cache_class.from_legacy_cache(past_key_values)
+        kwargs = {}
+        if self.accepts_position_ids:
+            kwargs["position_ids"] = position_ids
+        output = self.model(
+            input_ids=input_ids,
+            attention_mask=attention_mask,
+            past_key_values=past_key_values,
+            use_cache=True,
+            **kwargs,
+        )
+        if hasattr(output.past_key_values, "from_legacy_cache"):
+            self.cache_class = type(output.past_key_values)
+        past_key_values = to_legacy_cache(output.past_key_values)
+        self._check_layout(past_key_values, attention_mask)
+        next_tokens = output.logits[:, -1, :].argmax(dim=-1, keepdim=True)
+        return next_tokens, past_key_values
+
+    @staticmethod
+    def _check_layout(past_key_values, attention_mask):
+        batch_size, length = attention_mask.shape
+        for layer in past_key_values:
+            for tensor in layer:
+                if tensor.dim() != 4 or tuple(tensor.shape[::2]) != (
+                    batch_size,
+                    length,
+                ):
+                    raise ValueError(
+                        "continuous batching requires a key value cache with the shape (batch, heads, sequence, dim)"
+                    )
+
+    def _add_tokens(self, sequences, next_tokens):
+        for sequence, token in zip(sequences, next_tokens[:, 0].tolist()):
+            sequence.add_token(token, self.eos_token_ids)
+
+    @staticmethod
+    def _position_ids(attention_mask):
+        position_ids = attention_mask.long().cumsum(-1) - 1
+        position_ids.masked_fill_(attention_mask == 0, 1)
+        return position_ids
+
+    def _prefill(self, sequences, inputs):
+        if self.prefix_cache is not None:
+            return self._prefill_with_prefix_cache(sequences, inputs)
+        input_ids = inputs["input_ids"]
+        attention_mask = inputs["attention_mask"]
+        with torch.inference_mode():
+            next_tokens, past_key_values = self._forward(
+                input_ids, attention_mask, self._position_ids(attention_mask), None
+            )
+        self._add_tokens(sequences, next_tokens)
+        return next_tokens, attention_mask, past_key_values
+
+    def _stack_prefixes(self, matches, prefix_length, reference):
+        layers = []
+        for i, reference_layer in enumerate(reference):
+            layer = []
+            for j, reference_tensor in enumerate(reference_layer):
+                heads, _, dim = reference_tensor.shape
+                layer.append(
+                    torch.stack(
+                        [
+                            (
+                                pad_left(kv[i][j], prefix_length, 1)
+                                if kv is not None
+                                else reference_tensor.new_zeros(
+                                    heads, prefix_length, dim
+                                )
+                            )
+                            for _, kv in matches
+                        ]
+                    )
+                )
+            layers.append(tuple(layer))
+        return tuple(layers)
+
+    def _prefill_with_prefix_cache(self, sequences, inputs):
+        input_ids = inputs["input_ids"]
+        attention_mask = inputs["attention_mask"]
+        rows = [
+            ids[mask.bool()].tolist() for ids, mask in zip(input_ids, attention_mask)
+        ]
+        matches = [self.prefix_cache.match(row) for row in rows]
+        prefix_length = max(length for length, _ in matches)
+        if prefix_length == 0:
+            past_key_values = None
+        else:
+            reference = next(kv for _, kv in matches if kv is not None)
+            past_key_values = self._stack_prefixes(matches, prefix_length, reference)
+            suffixes = [row[length:] for row, (length, _) in zip(rows, matches)]
+            suffix_length = max(len(suffix) for suffix in suffixes)
+            input_ids = input_ids.new_full(
+                (len(rows), suffix_length), self.tokenizer.pad_token_id
+            )
+            prefix_mask = attention_mask.new_zeros((len(rows), prefix_length))
+            suffix_mask = attention_mask.new_zeros((len(rows), suffix_length))
+            for i, ((length, _), suffix) in enumerate(zip(matches, suffixes)):
+                input_ids[i, suffix_length - len(suffix) :] = input_ids.new_tensor(
+                    suffix
+                )
+                prefix_mask[i, prefix_length - length :] = 1
+                suffix_mask[i, suffix_length - len(suffix) :] = 1
+            attention_mask = torch.cat([prefix_mask, suffix_mask], dim=1)
+        position_ids = self._position_ids(attention_mask)[:, prefix_length:]
+        with torch.inference_mode():
+            next_tokens, past_key_values = self._forward(
+                input_ids, attention_mask, position_ids, past_key_values
+            )
+        for i, row in enumerate(rows):
+            (positions,) = torch.nonzero(attention_mask[i], as_tuple=True)
+            self.prefix_cache.insert(
+                row,
+                tuple(
+                    tuple(tensor[i].index_select(1, positions) for tensor in layer)
+                    for layer in past_key_values
+                ),
+            )
+        self._add_tokens(sequences, next_tokens)
+        return next_tokens, attention_mask, past_key_values
+
+    def _merge(self, sequences, input_ids, attention_mask, past_key_values):
+        if not self.sequences:
+            self.sequences = sequences
+            self.input_ids = input_ids
+            self.attention_mask = attention_mask
+            self.past_key_values = past_key_values
+            return
+        length = max(self.attention_mask.size(1), attention_mask.size(1))
+        self.attention_mask = torch.cat(
+            [
+                pad_left(self.attention_mask, length, 1),
+                pad_left(attention_mask, length, 1),
+            ]
+        )
+        self.past_key_values = tuple(
+            tuple(
+                torch.cat([pad_left(old, length, 2), pad_left(new, length, 2)])
+                for old, new in zip(old_layer, new_layer)
+            )
+            for old_layer, new_layer in zip(self.past_key_values, past_key_values)
+        )
+        self.input_ids = torch.cat([self.input_ids, input_ids])
+        self.sequences = self.sequences + sequences
+
+    def _filter(self, keep):
+        self.sequences = [self.sequences[i] for i in keep]
+        if not self.sequences:
+            self.input_ids = None
+            self.attention_mask = None
+            self.past_key_values = None
+            return
+        index = torch.tensor(keep, device=self.attention_mask.device)
+        attention_mask = self.attention_mask.index_select(0, index)
+        (used,) = torch.nonzero(attention_mask.sum(dim=0), as_tuple=True)
+        start = int(used[0]) if len(used) else 0
+        self.attention_mask = attention_mask[:, start:]
+        self.input_ids = self.input_ids.index_select(0, index)
+        self.past_key_values = tuple(
+            tuple(tensor.index_select(0, index)[:, :, start:] for tensor in layer)
+            for layer in self.past_key_values
+        )
+
+    def add(self, sequences, inputs):
+        if self.is_cuda:
+            inputs = {k: v.cuda() for k, v in inputs.items()}
+        next_tokens, attention_mask, past_key_values = self._prefill(sequences, inputs)
+        self._merge(sequences, next_tokens, attention_mask, past_key_values)
+
+    def step(self):
+        if not self.sequences:
+            return 0
+        ones = torch.ones_like(self.attention_mask[:, :1])
+        attention_mask = torch.cat([self.attention_mask, ones], dim=1)
+        position_ids = self.attention_mask.long().sum(dim=1, keepdim=True)
+        with torch.inference_mode():
+            next_tokens, past_key_values = self._forward(
+                self.input_ids, attention_mask, position_ids, self.past_key_values
+            )
+        self.input_ids = next_tokens
+        self.attention_mask = attention_mask
+        self.past_key_values = past_key_values
+        self._add_tokens(self.sequences, next_tokens)
+        return len(self.sequences)
+
+    def pop_finished(self, is_cancelled=None):
+        finished = []
+        keep = []
+        for i, sequence in enumerate(self.sequences):
+            if sequence.is_finished:
+                finished.append(sequence)
+            elif is_cancelled is None or not is_cancelled(sequence):
+                keep.append(i)
+        if len(keep) != len(self.sequences):
+            self._filter(keep)
+        return finished
+
+    def clear(self):
+        sequences = self.sequences
+        self._filter([])
+        return sequences
@@ -0,0 +1,159 @@
+import itertools
+import threading
+
+import torch
+
+
+def slice_kv(kv, start, end=None, clone=False):
+    sliced = tuple(tuple(tensor[:, start:end] for tensor in layer) for layer in kv)
+    if clone:
+        sliced = tuple(tuple(tensor.clone() for tensor in layer) for layer in sliced)
+    return sliced
+
+
+def concat_kv(kvs):
+    if len(kvs) == 1:
+        return kvs[0]
+    return tuple(
+        tuple(torch.cat(tensors, dim=1) for tensors in zip(*layers))
+        for layers in zip(*kvs)
+    )
+
+
+class Node:
+    def __init__(self, tokens, kv, parent):
+        self.tokens = tokens
+        self.kv = kv
+        self.parent = parent
+        self.children = {}
+        self.last_access = 0
+
+    def __len__(self):
+        return len(self.tokens)
+
+    def common_length(self, tokens, start):
+        length = 0
+        for a, b in zip(self.tokens, itertools.islice(tokens, start, None)):
+            if a != b:
+                break
+            length += 1
+        return length
+
+    def split(self, length):
+        child = Node(self.tokens[length:], slice_kv(self.kv, length, clone=True), self)
+        child.children = self.children
+        child.last_access = self.last_access
+        for grandchild in child.children.values():
+            grandchild.parent = child
+        self.tokens = self.tokens[:length]
+        self.kv = slice_kv(self.kv, 0, length, clone=True)
+        self.children = {child.tokens[0]: child}
+
+
+class PrefixCache:
+    def __init__(self, capacity):
+        assert capacity > 0, "the prefix cache capacity has to be at least 1 token"
+        self.capacity = capacity
+        self.root = Node((), None, None)
+        self.size = 0
+        self.clock = 0
+        self.lock = threading.Lock()
+        self.lookups = 0
+        self.hits = 0
+        self.prompt_tokens = 0
+        self.hit_tokens = 0
+        self.evicted_tokens = 0
+
+    def settings(self):
+        return {"prefix cache tokens": self.capacity}
+
+    def statistics(self):
+        return {
+            "tokens in prefix cache": self.size,
+            "prefix cache lookups": self.lookups,
+            "prefix cache hits": self.hits,
+            "prefix cache hit rate": self.hits / self.lookups if self.lookups else 0.0,
+            "prefix cache reused tokens": self.hit_tokens,
+            "prefix cache reused token rate": (
+                self.hit_tokens / self.prompt_tokens if self.prompt_tokens else 0.0
+            ),
+            "prefix cache evicted tokens": self.evicted_tokens,
+        }
+
+    def _tick(self):
+        self.clock += 1
+        return self.clock
+
+    def match(self, tokens):
+        with self.lock:
+            tick = self._tick()
+            max_length = len(tokens) - 1
+            node = self.root
+            length = 0
+            kvs = []
+            while length < max_length:
+                try:
+                    child = node.children[tokens[length]]
+                except KeyError:
+                    break
+                common = min(child.common_length(tokens, length), max_length - length)
+                child.last_access = tick
+                kvs.append(
+                    child.kv if common == len(child) else slice_kv(child.kv, 0, common)
+                )
+                length += common
+                if common < len(child):
+                    break
+                node = child
+            self.lookups += 1
+            self.prompt_tokens += len(tokens)
+            if length == 0:
+                return 0, None
+            self.hits += 1
+            self.hit_tokens += length
+            return length, concat_kv(kvs)
+
+    def insert(self, tokens, kv):
+        with self.lock:
+            tick = self._tick()
+            node = self.root
+            length = 0
+            while length < len(tokens):
+                try:
+                    child = node.children[tokens[length]]
+                except KeyError:
+                    leaf = Node(
+                        tuple(tokens[length:]), slice_kv(kv, length, clone=True), node
+                    )
+                    leaf.last_access = tick
+                    node.children[leaf.tokens[0]] = leaf
+                    self.size += len(leaf)
+                    break
+                common = child.common_length(tokens, length)
+                if common < len(child):
+                    child.split(common)
+                child.last_access = tick
+                length += common
+                node = child
+            self._evict()
+
+    def _leaves(self):
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            if node.children:
+                stack.extend(node.children.values())
+            elif node is not self.root:
+                yield node
+
+    def _evict(self):
+        while self.size > self.capacity:
+            leaf = min(self._leaves(), key=lambda node: node.last_access)
+            del leaf.parent.children[leaf.tokens[0]]
+            self.size -= len(leaf)
+            self.evicted_tokens += len(leaf)
+
+    def clear(self):
+        with self.lock:
+            self.root = Node((), None, None)
+            self.size = 0
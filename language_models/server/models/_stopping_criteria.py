@@ -1,6 +1,10 @@
-from transformers import StoppingCriteria, StoppingCriteriaList
+import time
+
+from transformers import (LogitsProcessor, LogitsProcessorList,
+                          StoppingCriteria, StoppingCriteriaList)
 
 from ._stream_detokenizer import StreamDetokenizer
+from ._string_matcher import get_matcher
 
 
 class StringStoppingCriteria(StoppingCriteria):
@@ -16,8 +20,9 @@ class StringStoppingCriteria(StoppingCriteria):
         self.stream_detokenizer = StreamDetokenizer(tokenizer)
         self.inclusive = self.convert_stopping_definitions(prompt, inclusive)
         self.exclusive = self.convert_stopping_definitions(prompt, exclusive)
-        self.is_empty = len(self.inclusive) + len(self.exclusive) == 0
-        self.decoded = ""
+        self.matcher = get_matcher(self.inclusive, self.exclusive)
+        self.is_empty = self.matcher.is_empty()
+        self.state = 0
         self.stop_string = None
 
     @staticmethod
@@ -27,6 +32,7 @@ class StringStoppingCriteria(StoppingCriteria):
                 return []
             return stopping_definitions
         stripped = prompt.rstrip()
+        stopping_definitions = dict(stopping_definitions)
         stopping_strings = set()
         if None in stopping_definitions:
             stopping_strings.update(stopping_definitions.pop(None))
@@ -40,23 +46,20 @@ class StringStoppingCriteria(StoppingCriteria):
                     stopping_strings.update(stop_chars)
         return stopping_strings
 
-    def _contains_stop_string(self, stop_set, token, remove):
-        for string in stop_set:
-            lookback = len(string) + len(token) - 1
-            if string in self.decoded[-lookback:]:
-                self.stop_string = string
-                self.remove = remove
-                return True
+    def holdback(self):
+        return max((len(e) for e in [*self.inclusive, *self.exclusive]), default=1) - 1
 
     def should_stop(self, token):
         if self.is_empty:
             return False
         if not isinstance(token, str):
             token = self.stream_detokenizer(token)
-        self.decoded += token
-        return self._contains_stop_string(
-            self.exclusive, token, True
-        ) or self._contains_stop_string(self.inclusive, token, False)
+        self.state, stop_string, remove = self.matcher.feed(self.state, token)
+        if stop_string is None:
+            return False
+        self.stop_string = stop_string
+        self.remove = remove
+        return True
 
     def __call__(self, input_ids, _):
         try:
@@ -77,6 +80,80 @@ class StringStoppingCriteria(StoppingCriteria):
         return StoppingCriteriaList([self])
 
 
+class BatchStringStoppingCriteria(StoppingCriteria):
+    def __init__(self, criterias, eos_token_id=None, streamers=None, cancel=None):
+        super().__init__()
+        self.criterias = criterias
+        self.streamers = streamers
+        self.cancel = cancel
+        if eos_token_id is None:
+            eos_token_id = []
+        elif isinstance(eos_token_id, int):
+            eos_token_id = [eos_token_id]
+        self.eos_token_ids = set(eos_token_id)
+        self.lengths = [None] * len(criterias)
+        self.first_step = None
+
+    def __len__(self):
+        return len(self.criterias)
+
+    def __getitem__(self, i):
+        return self.criterias[i]
+
+    def is_stopped(self, i):
+        return self.lengths[i] is not None
+
+    def all_stopped(self):
+        return all(length is not None for length in self.lengths)
+
+    def __call__(self, input_ids, _):
+        if self.first_step is None:
+            self.first_step = time.perf_counter()
+        length = input_ids.shape[1]
+        for i, criteria in enumerate(self.criterias):
+            if self.is_stopped(i):
+                continue
+            if self.cancel is not None and self.cancel(i):
+                self.lengths[i] = length
+                continue
+            input_id = input_ids[i, -1].item()
+            if input_id in self.eos_token_ids or criteria.should_stop(input_id):
+                self.lengths[i] = length
+            elif self.streamers is not None:
+                self.streamers[i].put(input_id)
+        return self.all_stopped()
+
+    def cut(self, i, output):
+        length = self.lengths[i]
+        if length is not None:
+            output = output[:length]
+        return output
+
+    def logits_processor(self):
+        if not self.eos_token_ids:
+            return None
+        return LogitsProcessorList(
+            [StoppedSequencesLogitsProcessor(self, min(self.eos_token_ids))]
+        )
+
+
+class StoppedSequencesLogitsProcessor(LogitsProcessor):
+    def __init__(self, stopping_criteria, eos_token_id):
+        self.stopping_criteria = stopping_criteria
+        self.eos_token_id = eos_token_id
+
+    def __call__(self, input_ids, scores):
+        stopped = [
+            i
+            for i in range(len(self.stopping_criteria))
+            if self.stopping_criteria.is_stopped(i)
+        ]
+        if stopped:
+            scores[stopped, :] = -float("inf")
+            scores[stopped, self.eos_token_id] = 0
+        return scores
+
+
 def merge_set_dicts(dict1, dict2):
     if not dict1:
         return dict2
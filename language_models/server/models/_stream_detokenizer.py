@@ -1,16 +1,38 @@
 class StreamDetokenizer:
-    def __init__(self, tokenizer):
+    def __init__(self, tokenizer, skip_special_tokens=False):
         self.tokenizer = tokenizer
-        self.prev_tokens = []
+        self.skip_special_tokens = skip_special_tokens
+        self.tokens = []
+        self.read_offset = 0
+        self.prefix_text = ""
 
     def _decode(self, tokens):
-        return self.tokenizer.decode(tokens, skip_special_tokens=False)
+        return self.tokenizer.decode(
+            tokens, skip_special_tokens=self.skip_special_tokens
+        )
 
     def __call__(self, token):
-        prefix_text = self._decode(self.prev_tokens)
-        self.prev_tokens.append(token)
-        new_text = self._decode(self.prev_tokens)
-        new_text = "" if new_text.endswith("�") else new_text[len(prefix_text) :]
-        if new_text:
-            self.prev_tokens = [token]
+        self.tokens.append(token)
+        text = self._decode(self.tokens)
+        if text.endswith("�") or len(text) <= len(self.prefix_text):
+            return ""
+        new_text = text[len(self.prefix_text) :]
+        self.tokens = self.tokens[self.read_offset :]
+        self.read_offset = len(self.tokens)
+        self.prefix_text = self._decode(self.tokens)
         return new_text
+
+
+class SequenceStreamer:
+    def __init__(self, tokenizer, callback, holdback=0):
+        self.detokenizer = StreamDetokenizer(tokenizer, skip_special_tokens=True)
+        self.callback = callback
+        self.holdback = holdback
+        self.pending = ""
+
+    def put(self, token):
+        self.pending += self.detokenizer(token)
+        end = len(self.pending) - self.holdback
+        if end > 0:
+            self.callback(self.pending[:end])
+            self.pending = self.pending[end:]
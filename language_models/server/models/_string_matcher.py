@@ -0,0 +1,91 @@
+from collections import deque
+from functools import lru_cache
+
+
+class StringMatcher:
+    def __init__(self, inclusive, exclusive):
+        self.goto = [{}]
+        self.fail = [0]
+        self.matches = [(None, None)]
+        for string in inclusive:
+            self._insert(string, False)
+        for string in exclusive:
+            self._insert(string, True)
+        self._build()
+
+    def _insert(self, string, remove):
+        if not string:
+            return
+        state = 0
+        for char in string:
+            try:
+                state = self.goto[state][char]
+            except KeyError:
+                self.goto[state][char] = len(self.goto)
+                state = len(self.goto)
+                self.goto.append({})
+                self.fail.append(0)
+                self.matches.append((None, None))
+        inclusive, exclusive = self.matches[state]
+        if remove:
+            exclusive = string
+        else:
+            inclusive = string
+        self.matches[state] = inclusive, exclusive
+
+    @staticmethod
+    def _longest(a, b):
+        if a is None or (b is not None and len(b) > len(a)):
+            return b
+        return a
+
+    def _build(self):
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self.goto[state].items():
+                fail = self.fail[state]
+                while fail and char not in self.goto[fail]:
+                    fail = self.fail[fail]
+                fail = self.goto[fail].get(char, 0)
+                self.fail[next_state] = fail
+                inclusive, exclusive = self.matches[next_state]
+                fail_inclusive, fail_exclusive = self.matches[fail]
+                self.matches[next_state] = (
+                    self._longest(inclusive, fail_inclusive),
+                    self._longest(exclusive, fail_exclusive),
+                )
+                queue.append(next_state)
+
+    def is_empty(self):
+        return len(self.goto) == 1
+
+    def step(self, state, char):
+        goto = self.goto
+        while char not in goto[state]:
+            if not state:
+                return 0
+            state = self.fail[state]
+        return goto[state][char]
+
+    def feed(self, state, text):
+        inclusive = None
+        for char in text:
+            state = self.step(state, char)
+            match_inclusive, match_exclusive = self.matches[state]
+            if match_exclusive is not None:
+                return state, match_exclusive, True
+            if inclusive is None:
+                inclusive = match_inclusive
+        if inclusive is not None:
+            return state, inclusive, False
+        return state, None, None
+
+
+@lru_cache(maxsize=256)
+def _cached_matcher(inclusive, exclusive):
+    return StringMatcher(inclusive, exclusive)
+
+
+def get_matcher(inclusive, exclusive):
+    return _cached_matcher(frozenset(inclusive), frozenset(exclusive))
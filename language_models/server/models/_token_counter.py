@@ -1,84 +1,141 @@
+from copy import deepcopy
+from threading import Lock
+
 import numpy as np
+from cachetools import LRUCache
 
 from ._stream_detokenizer import StreamDetokenizer
 
 
+def assign_counts(ends, lengths, indicate_shared=False):
+    boundaries = np.cumsum(lengths)
+    reached = np.maximum.accumulate(ends) if len(ends) else np.zeros(0, dtype=int)
+    num_committed = int(
+        np.searchsorted(boundaries, reached[-1] if len(reached) else 0, side="right")
+    )
+    starts = np.concatenate(([0], reached[:-1]))
+    segments = np.searchsorted(boundaries, starts, side="right")
+    counts = np.bincount(segments, minlength=len(boundaries) + 1)[:num_committed]
+    counts = [int(count) for count in counts]
+    if indicate_shared and len(reached):
+        boundaries = boundaries[:num_committed]
+        first_reaching = reached[np.searchsorted(reached, boundaries)]
+        is_partial = (first_reaching != boundaries) & (boundaries != 0)
+        counts = [
+            count + 0.5 if partial else count
+            for count, partial in zip(counts, is_partial)
+        ]
+    return counts
+
+
 class TokenCounter:
-    def __init__(self, tokenizer, texts, indicate_shared=False):
-        self.is_single = isinstance(texts, str)
-        if self.is_single:
-            texts = [texts]
-        tokenized = tokenizer(
-            ["".join(texts)],
+    def __init__(self, tokenizer, cache_size=4096):
+        self.tokenizer = tokenizer
+        self.cache = LRUCache(cache_size) if cache_size > 0 else None
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def statistics(self):
+        return {
+            "token count cache hits": self.hits,
+            "token count cache misses": self.misses,
+        }
+
+    def _token_ends(self, documents):
+        tokenized = self.tokenizer(
+            ["".join(texts) for texts in documents],
             truncation=False,
             return_token_type_ids=False,
             return_attention_mask=False,
             return_special_tokens_mask=True,
-            return_offsets_mapping=tokenizer.is_fast,
+            return_offsets_mapping=self.tokenizer.is_fast,
             return_length=True,
         )
-        (special_tokens_mask,) = tokenized["special_tokens_mask"]
-        if tokenizer.is_fast:
-            (offsets_mapping,) = tokenized["offset_mapping"]
-            self.ends = [
-                end
-                for (_, end), special in zip(offsets_mapping, special_tokens_mask)
-                if special == 0
-            ]
-        else:
-            (input_ids,) = tokenized["input_ids"]
-            detokenizer = StreamDetokenizer(tokenizer)
-            self.ends = np.cumsum(
-                [
-                    len(detokenizer(token))
-                    for token, special in zip(input_ids, special_tokens_mask)
-                    if special == 0
-                ]
+        for i, special_tokens_mask in enumerate(tokenized["special_tokens_mask"]):
+            is_content = np.array(special_tokens_mask, dtype=bool) == 0
+            if self.tokenizer.is_fast:
+                offsets_mapping = np.array(
+                    tokenized["offset_mapping"][i], dtype=int
+                ).reshape(-1, 2)
+                ends = offsets_mapping[is_content, 1]
+            else:
+                detokenizer = StreamDetokenizer(self.tokenizer)
+                input_ids = np.array(tokenized["input_ids"][i])[is_content]
+                ends = np.cumsum([len(detokenizer(token)) for token in input_ids])
+            yield ends, tokenized["length"][i]
+
+    def _count(self, documents, indicate_shared):
+        results = []
+        texts_list = [
+            [texts] if isinstance(texts, str) else texts for texts in documents
+        ]
+        for texts, original, (ends, num_all_tokens) in zip(
+            texts_list, documents, self._token_ends(texts_list)
+        ):
+            counts = assign_counts(ends, [len(e) for e in texts], indicate_shared)
+            if isinstance(original, str):
+                (counts,) = counts
+            results.append(
+                {
+                    "counts": counts,
+                    "num": {
+                        "all": num_all_tokens,
+                        "special": num_all_tokens - len(ends),
+                        "non_special": len(ends),
+                    },
+                }
             )
-        (self.num_all_tokens,) = tokenized["length"]
-        self.num_non_special_tokens = len(self.ends)
-        self.num_special_tokens = self.num_all_tokens - self.num_non_special_tokens
-        self.counts = []
-        self.current_count = 0
-        self.current_length = 0
-        self.length_iter = iter(np.cumsum([len(e) for e in texts]))
-        self.indicate_shared = indicate_shared
+        return results
 
-    def results(self):
-        return {
-            "counts": self.counts,
-            "num": {
-                "all": self.num_all_tokens,
-                "special": self.num_special_tokens,
-                "non_special": self.num_non_special_tokens,
-            },
-        }
+    @staticmethod
+    def _key(texts, indicate_shared):
+        if isinstance(texts, str):
+            return texts, indicate_shared
+        return tuple(texts), indicate_shared
 
-    def _commit_count(self, is_partial):
-        if self.indicate_shared and is_partial:
-            self.current_count += 0.5
-        self.counts.append(self.current_count)
-        self.current_count = 0
+    def batch(self, documents, indicate_shared=False):
+        if self.cache is None:
+            return self._count(documents, indicate_shared)
+        keys = [self._key(texts, indicate_shared) for texts in documents]
+        results = [None] * len(documents)
+        missing = {}
+        with self.lock:
+            for i, key in enumerate(keys):
+                result = self.cache.get(key)
+                if result is None:
+                    missing.setdefault(key, []).append(i)
+                else:
+                    results[i] = result
+            num_missing = sum(len(indices) for indices in missing.values())
+            self.hits += len(documents) - num_missing
+            self.misses += num_missing
+        if missing:
+            counted = self._count(
+                [documents[indices[0]] for indices in missing.values()],
+                indicate_shared,
+            )
+            with self.lock:
+                for (key, indices), result in zip(missing.items(), counted):
+                    self.cache[key] = result
+                    for i in indices:
+                        results[i] = result
+        return [deepcopy(result) for result in results]
 
-    def _get_next_length(self, is_partial):
-        while (next_length := next(self.length_iter)) == self.current_length:
-            self._commit_count(is_partial)
-        return next_length
+    def __call__(self, texts, indicate_shared=False):
+        (result,) = self.batch([texts], indicate_shared)
+        return result
 
-    def consume(self):
-        if self.counts:
-            raise Exception("already consumed")
-        try:
-            self.current_length = self._get_next_length(False)
-            for end in self.ends:
-                self.current_count += 1
-                while self.current_length <= end:
-                    self._commit_count(self.current_length != end)
-                    self.current_length = self._get_next_length(
-                        self.current_length != end
-                    )
-        except StopIteration:
-            pass
-        if self.is_single:
-            (self.counts,) = self.counts
-        return self.counts
+    def trim(self, template, segments, max_tokens):
+        if "{input}" in template:
+            *prefix, suffix = template.split("{input}")
+            prefix = "{input}".join(prefix)
+        else:
+            prefix, suffix = template, ""
+        size_info = self([prefix, *segments, suffix])
+        counts = size_info["counts"][1 : len(segments) + 1]
+        max_tokens -= size_info["num"]["all"] - sum(counts)
+        segments_used = int(np.searchsorted(np.cumsum(counts), max_tokens, side="left"))
+        if segments_used == len(counts):
+            segments_used = len(segments)
+        return prefix + "".join(segments[:segments_used]) + suffix, segments_used
@@ -1,5 +1,7 @@
 import enum
 import gc
+import time
+from functools import partial
 from pathlib import Path
 from typing import Dict, List, Literal, Optional, Set, Union
 
@@ -7,10 +9,14 @@ import numpy as np
 import torch
 from pydantic import BaseModel, Field
 from transformers import (AutoModelForCausalLM, AutoModelForSeq2SeqLM,
-                          AutoTokenizer)
+                          AutoTokenizer, StoppingCriteriaList)
 
-from ._stopping_criteria import (StringStoppingCriteria,
+from ._continuous_batching import ContinuousBatch, Sequence
+from ._prefix_cache import PrefixCache
+from ._stopping_criteria import (BatchStringStoppingCriteria,
+                                 StringStoppingCriteria,
                                  merge_stopping_criterias)
+from ._stream_detokenizer import SequenceStreamer
 from ._token_counter import TokenCounter
 
 
@@ -19,6 +25,11 @@ class TokenizeModel(BaseModel):
     indicate_shared: bool = False
 
 
+class TokenizeBatchModel(BaseModel):
+    texts: List[Union[List[str], str]]
+    indicate_shared: bool = False
+
+
 class ModelTypes(enum.Enum):
     DECODER = enum.auto()
     ENCODER_DECODER = enum.auto()
@@ -78,6 +89,7 @@ def build_transformers_model(
             self.tokenizer = AutoTokenizer.from_pretrained(
                 pretrained_model_name_or_path, **tokenizer_kwargs
             )
+            self.token_counter = TokenCounter(self.tokenizer)
             if model_type == ModelTypes.DECODER:
                 auto_model_class = AutoModelForCausalLM
             elif model_type == ModelTypes.ENCODER_DECODER:
@@ -91,6 +103,44 @@ def build_transformers_model(
                 torch_dtype=dtype,
             )
             self.is_cuda = str(self.model.device) != "cpu"
+            if model_type == ModelTypes.DECODER:
+                self.tokenizer.padding_side = "left"
+            if self.tokenizer.pad_token is None:
+                self.tokenizer.pad_token = self.tokenizer.eos_token
+            self.eos_token_id = self.model.generation_config.eos_token_id
+            if self.eos_token_id is None:
+                self.eos_token_id = self.tokenizer.eos_token_id
+            self.prefix_cache = None
+
+        def enable_prefix_cache(self, capacity):
+            if model_type != ModelTypes.DECODER:
+                raise ValueError("prefix caching is only supported for decoder models")
+            self.prefix_cache = PrefixCache(capacity)
+
+        def enable_processes(self, num_processes):
+            if self.is_cuda:
+                raise ValueError("worker processes are only supported on the cpu")
+            num_threads = max(1, torch.get_num_threads() // num_processes)
+            return partial(torch.set_num_threads, num_threads)
+
+        def memory_headroom(self):
+            if not self.is_cuda:
+                return None
+            device = self.model.device
+            free, total = torch.cuda.mem_get_info(device)
+            reserved = torch.cuda.memory_reserved(device)
+            allocated = torch.cuda.memory_allocated(device)
+            return (free + reserved - allocated) / total
+
+        def statistics(self):
+            statistics = self.token_counter.statistics()
+            if self.prefix_cache is None:
+                return statistics
+            return (
+                statistics
+                | self.prefix_cache.settings()
+                | self.prefix_cache.statistics()
+            )
 
         def get_meta(self):
             return {
@@ -99,12 +149,24 @@ def build_transformers_model(
             }
 
         def router_hook(self, router):
+            definition = (
+                self.tokenizer.backend_tokenizer.to_str()
+                if self.tokenizer.is_fast
+                else None
+            )
+
+            def tokenizer():
+                return {"definition": definition}
+
             def tokenizer_count(body: TokenizeModel):
-                counter = TokenCounter(self.tokenizer, body.text, body.indicate_shared)
-                counter.consume()
-                return counter.results()
+                return self.token_counter(body.text, body.indicate_shared)
+
+            def tokenizer_count_batch(body: TokenizeBatchModel):
+                return self.token_counter.batch(body.texts, body.indicate_shared)
 
+            router.get("/tokenizer")(tokenizer)
             router.post("/tokenizer/count")(tokenizer_count)
+            router.post("/tokenizer/count/batch")(tokenizer_count_batch)
 
         def get_string_stopping_criteria(self, prompt, stopping_strings):
             inclusive, exclusive = merge_stopping_criterias(
@@ -117,9 +179,44 @@ def build_transformers_model(
                 exclusive=exclusive,
             )
 
-        def tokenize(self, prompt):
+        def get_streamer(self, stopping_criteria, callback):
+            return SequenceStreamer(
+                self.tokenizer, callback, holdback=stopping_criteria.holdback()
+            )
+
+        def input_lengths(self, prompts):
+            if self.tokenizer.is_fast:
+                encodings = self.tokenizer.backend_tokenizer.encode_batch(prompts)
+                lengths = [len(encoding.ids) for encoding in encodings]
+            else:
+                lengths = [len(self.tokenizer.encode(prompt)) for prompt in prompts]
+            return lengths
+
+        def max_input_length(self):
+            return int(self.tokenizer.model_max_length)
+
+        def trim_prompt(
+            self,
+            template,
+            segments,
+            instruction=None,
+            max_length=None,
+            max_new_tokens=None,
+        ):
+            if instruction is not None:
+                template = template.replace("{instruction}", instruction)
+            max_tokens = int(self.tokenizer.model_max_length)
+            if max_length is not None:
+                max_tokens = min(max_tokens, max_length)
+            if model_type == ModelTypes.DECODER:
+                if max_new_tokens is None:
+                    max_new_tokens = default_max_new_tokens
+                max_tokens -= max_new_tokens
+            return self.token_counter.trim(template, segments, max_tokens)
+
+        def tokenize(self, prompts):
             inputs = self.tokenizer(
-                [prompt],
+                prompts,
                 return_token_type_ids=False,
                 truncation=True,
                 return_overflowing_tokens=True,
@@ -145,46 +242,184 @@ def build_transformers_model(
                 ]
                 input_ids = inputs["input_ids"]
                 attention_mask = inputs["attention_mask"]
+            inputs = self.tokenizer.pad(
+                {"input_ids": input_ids, "attention_mask": attention_mask},
+                return_tensors="pt",
+            )
             return {
-                "input_ids": torch.tensor(input_ids),
-                "attention_mask": torch.tensor(attention_mask),
+                "input_ids": inputs["input_ids"],
+                "attention_mask": inputs["attention_mask"],
             }, num_overflow_tokens
 
         @cleanup_cuda
         def inference(
-            self, prompt, max_new_tokens=default_max_new_tokens, stopping_strings=None
+            self,
+            prompts,
+            max_new_tokens=default_max_new_tokens,
+            stopping_strings=None,
+            stream=None,
+            timings=None,
+            cancel=None,
         ):
+            if self.prefix_cache is not None:
+                return self.inference_continuous(
+                    prompts, max_new_tokens, stopping_strings, stream, timings, cancel
+                )
             with torch.inference_mode():
-                inputs, num_overflow_tokens = self.tokenize(prompt)
-                num_overflow_tokens = int(num_overflow_tokens[0])
-                stopping_criteria = self.get_string_stopping_criteria(
-                    prompt, stopping_strings
+                start = time.perf_counter()
+                inputs, num_overflow_tokens = self.tokenize(prompts)
+                tokenized = time.perf_counter()
+                criterias = [
+                    self.get_string_stopping_criteria(prompt, stopping_strings)
+                    for prompt in prompts
+                ]
+                streamers = None
+                if stream is not None:
+                    streamers = [
+                        self.get_streamer(criteria, partial(stream, i))
+                        for i, criteria in enumerate(criterias)
+                    ]
+                stopping_criteria = BatchStringStoppingCriteria(
+                    criterias,
+                    eos_token_id=self.eos_token_id,
+                    streamers=streamers,
+                    cancel=cancel,
                 )
-                num_input_tokens = int(inputs["input_ids"].size()[1])
+                num_input_tokens = inputs["attention_mask"].sum(dim=1).tolist()
+                num_padded_tokens = int(inputs["input_ids"].size()[1])
                 if self.is_cuda:
                     inputs = {k: v.cuda() for k, v in inputs.items()}
                 generate_args = {
                     "do_sample": False,
-                    "stopping_criteria": stopping_criteria.tolist(),
+                    "stopping_criteria": StoppingCriteriaList([stopping_criteria]),
+                    "logits_processor": stopping_criteria.logits_processor(),
                     "max_new_tokens": max_new_tokens,
                 }
                 if set_pad_token:
                     generate_args["pad_token_id"] = self.tokenizer.eos_token_id
-                (output,) = self.model.generate(**inputs, **generate_args)
-                if model_type == ModelTypes.DECODER and ommit_prompt:
-                    output = output[num_input_tokens:]
-                num_output_tokens = len(output)
-                generated = self.tokenizer.decode(output, skip_special_tokens=True)
-                generated = stopping_criteria.trim(generated)
-                return {
-                    "generated": generated,
-                    "size": {
-                        "input": num_input_tokens,
-                        "output": num_output_tokens,
-                        "overflow": num_overflow_tokens,
-                    },
-                    "stopping_reason": stopping_criteria.stop_string,
-                }
+                generate_start = time.perf_counter()
+                outputs = self.model.generate(**inputs, **generate_args)
+                generated = time.perf_counter()
+                results = []
+                for i, output in enumerate(outputs):
+                    output = stopping_criteria.cut(i, output)
+                    if model_type == ModelTypes.DECODER and ommit_prompt:
+                        output = output[num_padded_tokens:]
+                    results.append(
+                        self.make_result(
+                            stopping_criteria[i],
+                            output,
+                            num_input_tokens[i],
+                            num_overflow_tokens[i],
+                        )
+                    )
+                if timings is not None:
+                    first_step = stopping_criteria.first_step or generated
+                    timings.update(
+                        tokenize=tokenized - start,
+                        prefill=first_step - generate_start,
+                        decode=generated - first_step,
+                        detokenize=time.perf_counter() - generated,
+                    )
+                return results
+
+        def make_result(
+            self, stopping_criteria, output, num_input_tokens, num_overflow_tokens
+        ):
+            generated = self.tokenizer.decode(output, skip_special_tokens=True)
+            generated = stopping_criteria.trim(generated)
+            return {
+                "generated": generated,
+                "size": {
+                    "input": int(num_input_tokens),
+                    "output": len(output),
+                    "overflow": int(num_overflow_tokens),
+                },
+                "stopping_reason": stopping_criteria.stop_string,
+            }
+
+        def continuous_batch(self):
+            if model_type != ModelTypes.DECODER:
+                raise ValueError(
+                    "continuous batching is only supported for decoder models"
+                )
+            eos_token_ids = self.eos_token_id
+            if eos_token_ids is None:
+                eos_token_ids = []
+            elif isinstance(eos_token_ids, int):
+                eos_token_ids = [eos_token_ids]
+            return ContinuousBatch(self, set(eos_token_ids), self.prefix_cache)
+
+        @cleanup_cuda
+        def inference_continuous(
+            self,
+            prompts,
+            max_new_tokens,
+            stopping_strings=None,
+            stream=None,
+            timings=None,
+            cancel=None,
+        ):
+            start = time.perf_counter()
+            sequences, inputs = self.start_sequences(
+                prompts, max_new_tokens, stopping_strings, _stream=stream
+            )
+            tokenized = time.perf_counter()
+            batch = self.continuous_batch()
+            batch.add(sequences, inputs)
+            prefilled = time.perf_counter()
+            is_cancelled = None
+            if cancel is not None:
+                positions = {sequence: i for i, sequence in enumerate(sequences)}
+                is_cancelled = lambda sequence: cancel(positions[sequence])
+            while len(batch):
+                batch.pop_finished(is_cancelled)
+                batch.step()
+            decoded = time.perf_counter()
+            results = [self.sequence_result(sequence) for sequence in sequences]
+            if timings is not None:
+                timings.update(
+                    tokenize=tokenized - start,
+                    prefill=prefilled - tokenized,
+                    decode=decoded - prefilled,
+                    detokenize=time.perf_counter() - decoded,
+                )
+            return results
+
+        def start_sequences(
+            self,
+            batch,
+            max_new_tokens=default_max_new_tokens,
+            stopping_strings=None,
+            _stream=None,
+        ):
+            inputs, num_overflow_tokens = self.tokenize(batch)
+            num_input_tokens = inputs["attention_mask"].sum(dim=1).tolist()
+            sequences = [
+                Sequence(
+                    self.get_string_stopping_criteria(prompt, stopping_strings),
+                    max_new_tokens,
+                    num_input,
+                    num_overflow,
+                )
+                for prompt, num_input, num_overflow in zip(
+                    batch, num_input_tokens, num_overflow_tokens
+                )
+            ]
+            if _stream is not None:
+                for i, sequence in enumerate(sequences):
+                    sequence.streamer = self.get_streamer(
+                        sequence.stopping_criteria, partial(_stream, i)
+                    )
+            return sequences, inputs
+
+        def sequence_result(self, sequence):
+            return self.make_result(
+                sequence.stopping_criteria,
+                sequence.output,
+                sequence.num_input_tokens,
+                sequence.num_overflow_tokens,
+            )
 
         def __call__(
             self,
@@ -201,14 +436,17 @@ def build_transformers_model(
                 description="The strings to stop on, inclusive will return stopping string while exclusive will not.",
                 example={"inclusive": {"."}, "exclusive": {"</s>"}},
             ),
+            _stream=None,
+            _timings=None,
+            _cancel=None,
         ):
-            return [
-                self.inference(
-                    prompt,
-                    max_new_tokens=max_new_tokens,
-                    stopping_strings=stopping_strings,
-                )
-                for prompt in batch
-            ]
+            return self.inference(
+                batch,
+                max_new_tokens=max_new_tokens,
+                stopping_strings=stopping_strings,
+                stream=_stream,
+                timings=_timings,
+                cancel=_cancel,
+            )
 
     return Model
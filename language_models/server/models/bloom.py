@@ -1,3 +1,4 @@
+from functools import partial
 from typing import Dict, List, Literal, Optional, Set, Union
 
 import torch
@@ -7,6 +8,7 @@ from transformers import BloomTokenizerFast
 
 from ._stopping_criteria import (StringStoppingCriteria,
                                  merge_stopping_criterias)
+from ._stream_detokenizer import SequenceStreamer
 from ._token_counter import TokenCounter
 
 MODEL_NAME = "bigscience/bloom-petals"
@@ -20,6 +22,11 @@ class TokenizeModel(BaseModel):
     indicate_shared: bool = False
 
 
+class TokenizeBatchModel(BaseModel):
+    texts: List[Union[List[str], str]]
+    indicate_shared: bool = False
+
+
 class Model:
     TYPE = "generation"
     MAX_LENGTH = 2048
@@ -29,6 +36,7 @@ class Model:
         self.tokenizer = BloomTokenizerFast.from_pretrained(
             MODEL_NAME, model_max_length=self.MAX_LENGTH
         )
+        self.token_counter = TokenCounter(self.tokenizer)
         self.model = DistributedBloomForCausalLM.from_pretrained(
             MODEL_NAME, request_timeout=300
         ).cuda()
@@ -39,12 +47,37 @@ class Model:
         }
 
     def router_hook(self, router):
+        definition = self.tokenizer.backend_tokenizer.to_str()
+
+        def tokenizer():
+            return {"definition": definition}
+
         def tokenizer_count(body: TokenizeModel):
-            counter = TokenCounter(self.tokenizer, body.text, body.indicate_shared)
-            counter.consume()
-            return counter.results()
+            return self.token_counter(body.text, body.indicate_shared)
 
+        def tokenizer_count_batch(body: TokenizeBatchModel):
+            return self.token_counter.batch(body.texts, body.indicate_shared)
+
+        router.get("/tokenizer")(tokenizer)
         router.post("/tokenizer/count")(tokenizer_count)
+        router.post("/tokenizer/count/batch")(tokenizer_count_batch)
+
+    def trim_prompt(
+        self,
+        template,
+        segments,
+        instruction=None,
+        max_length=None,
+        max_new_tokens=None,
+    ):
+        if instruction is not None:
+            template = template.replace("{instruction}", instruction)
+        max_tokens = self.tokenizer.model_max_length
+        if max_length is not None:
+            max_tokens = min(max_tokens, max_length)
+        if max_new_tokens is None:
+            max_new_tokens = self.MAX_NEW_TOKENS
+        return self.token_counter.trim(template, segments, max_tokens - max_new_tokens)
 
     def get_string_stopping_criteria(self, prompt, stopping_strings):
         inclusive, exclusive = merge_stopping_criterias(
@@ -57,7 +90,7 @@ class Model:
             exclusive=exclusive,
         )
 
-    def inference(self, prompt, max_new_tokens, stopping_strings=None):
+    def inference(self, prompt, max_new_tokens, stopping_strings=None, stream=None):
         with torch.inference_mode():
             output = []
             inputs = self.tokenizer.encode(prompt, return_tensors="pt").cuda()
@@ -65,6 +98,11 @@ class Model:
             stopping_criteria = self.get_string_stopping_criteria(
                 prompt, stopping_strings
             )
+            streamer = None
+            if stream is not None:
+                streamer = SequenceStreamer(
+                    self.tokenizer, stream, holdback=stopping_criteria.holdback()
+                )
             with self.model.inference_session(
                 max_length=num_input_tokens + max_new_tokens
             ) as session:
@@ -76,10 +114,10 @@ class Model:
                     new_token_id = current_output[-1].item()
                     output.append(new_token_id)
                     new_token = self.tokenizer.decode(new_token_id)
-                    print(new_token, end="", flush=True)
                     if stopping_criteria.should_stop(new_token):
                         break
-                print(flush=True)
+                    if streamer is not None:
+                        streamer.put(new_token_id)
                 num_output_tokens = len(output)
                 num_overflow_tokens = 0
                 generated = self.tokenizer.decode(output, skip_special_tokens=True)
@@ -108,10 +146,14 @@ class Model:
             None,
             description="The strings to stop on, inclusive will return stopping string while exclusive will not.",
         ),
+        _stream=None,
     ):
         return [
             self.inference(
-                prompt, max_new_tokens=max_new_tokens, stopping_strings=stopping_strings
+                prompt,
+                max_new_tokens=max_new_tokens,
+                stopping_strings=stopping_strings,
+                stream=_stream and partial(_stream, i),
             )
-            for prompt in batch
+            for i, prompt in enumerate(batch)
         ]
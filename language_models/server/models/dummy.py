@@ -7,9 +7,11 @@ from pydantic import Field
 class Model:
     TYPE = "generation"
 
-    def __call__(self, batch, top_p: int = Field(0.1, ge=0.0, le=1.0)):
+    def __call__(self, batch, top_p: int = Field(0.1, ge=0.0, le=1.0), _stream=None):
         results = []
-        for prompt in batch:
+        for i, prompt in enumerate(batch):
             results.append(f"processed: {top_p} {prompt}")
+            if _stream is not None:
+                _stream(i, results[-1])
         time.sleep(random.expovariate(10))
         return results
@@ -1,6 +1,7 @@
 import enum
 import traceback
 
+from fastapi.exceptions import RequestValidationError
 from pydantic import ValidationError
 
 
@@ -9,6 +10,8 @@ class ResultTypes(enum.Enum):
     USER_ERROR = enum.auto()
     APPLICATION_ERROR = enum.auto()
     DISCONNECTED = enum.auto()
+    OVERLOADED = enum.auto()
+    EXPIRED = enum.auto()
 
 
 def validation_exception(exc):
@@ -29,7 +32,7 @@ def general_exception(exc):
 
 
 def exception_to_payload(exc):
-    if isinstance(exc, ValidationError):
+    if isinstance(exc, (ValidationError, RequestValidationError)):
         result = validation_exception(exc), 422
     else:
         print(traceback.format_exc())
@@ -45,6 +48,10 @@ def processed_to_payload(result_type, result=None):
         return {"success": False, "error": "USER", "message": result}, 400
     elif result_type == ResultTypes.APPLICATION_ERROR:
         return {"success": False, "error": "APPLICATION", "message": result}, 500
+    elif result_type == ResultTypes.OVERLOADED:
+        return {"success": False, "error": "OVERLOADED", **result}, 429
+    elif result_type == ResultTypes.EXPIRED:
+        return {"success": False, "error": "EXPIRED", "message": result}, 504
     elif result_type == ResultTypes.DISCONNECTED:
         return {
             "success": False,
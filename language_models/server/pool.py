@@ -0,0 +1,174 @@
+import asyncio
+import gc
+import multiprocessing
+import os
+import signal
+from multiprocessing import reduction
+from multiprocessing.connection import Connection
+
+from utils.aio import to_thread
+
+
+class ProcessExitedError(Exception):
+    pass
+
+
+def _template(func, connection, initializer):
+    signal.set_wakeup_fd(-1)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+    while True:
+        try:
+            connection.recv()
+        except EOFError:
+            return
+        fd = reduction.recv_handle(connection)
+        pid = os.fork()
+        if pid == 0:
+            connection.close()
+            signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+            try:
+                _serve(func, Connection(fd), initializer)
+            finally:
+                os._exit(0)
+        os.close(fd)
+        connection.send(pid)
+
+
+def _serve(func, connection, initializer):
+    if initializer is not None:
+        initializer()
+    while True:
+        try:
+            batch = connection.recv()
+        except EOFError:
+            return
+        if batch.pop("_stream", False):
+            batch["_stream"] = lambda i, text: connection.send(("stream", (i, text)))
+        try:
+            connection.send(("done", (func(**batch), batch.get("_timings"))))
+        except Exception as e:
+            connection.send(("error", str(e)))
+
+
+class TemplateProcess:
+    def __init__(self, context, func, initializer):
+        self.connection, child_connection = context.Pipe()
+        self.process = context.Process(
+            target=_template, args=(func, child_connection, initializer), daemon=True
+        )
+        self.process.start()
+        child_connection.close()
+
+    def fork(self, connection):
+        self.connection.send(None)
+        reduction.send_handle(self.connection, connection.fileno(), self.process.pid)
+        return self.connection.recv()
+
+    def close(self):
+        self.connection.close()
+        self.process.terminate()
+        self.process.join()
+
+
+class WorkerProcess:
+    def __init__(self, context, template):
+        self.connection, child_connection = context.Pipe()
+        self.pid = template.fork(child_connection)
+        child_connection.close()
+
+    def call(self, batch, stream):
+        self.connection.send(batch)
+        while True:
+            kind, value = self.connection.recv()
+            if kind == "stream":
+                stream(*value)
+            elif kind == "error":
+                raise ValueError(value)
+            else:
+                return value
+
+    def close(self):
+        self.connection.close()
+        try:
+            os.kill(self.pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+
+
+class ProcessPool:
+    def __init__(self, func, num_processes, initializer=None):
+        assert num_processes > 0, "the number of processes has to be at least 1"
+        self.func = func
+        self.num_processes = num_processes
+        self.initializer = initializer
+        self.context = multiprocessing.get_context("fork")
+        self.template = None
+        self.processes = None
+        self.idle = None
+        self.num_restarts = 0
+
+    def settings(self):
+        return {"processes": self.num_processes}
+
+    def statistics(self):
+        busy = 0 if self.idle is None else self.num_processes - self.idle.qsize()
+        return {"busy processes": busy, "restarted processes": self.num_restarts}
+
+    def startup(self):
+        if self.processes is not None:
+            raise ValueError("process pool is already running")
+        gc.collect()
+        gc.freeze()
+        self.template = TemplateProcess(self.context, self.func, self.initializer)
+        self.processes = []
+        self.idle = asyncio.Queue()
+        for _ in range(self.num_processes):
+            self._spawn()
+
+    def shutdown(self):
+        if self.processes is None:
+            raise ValueError("process pool is not running")
+        for process in self.processes:
+            process.close()
+        self.template.close()
+        self.template = None
+        self.processes = None
+        self.idle = None
+        gc.unfreeze()
+
+    def _spawn(self):
+        process = WorkerProcess(self.context, self.template)
+        self.processes.append(process)
+        self.idle.put_nowait(process)
+
+    def _replace(self, process):
+        process.close()
+        if self.processes is None:
+            return
+        self.processes.remove(process)
+        self.num_restarts += 1
+        self._spawn()
+
+    async def run(self, batch):
+        stream = batch.get("_stream")
+        if stream is not None:
+            batch = {**batch, "_stream": True}
+        timings = batch.get("_timings")
+        process = await self.idle.get()
+        try:
+            results, returned_timings = await to_thread(process.call, batch, stream)
+        except (EOFError, OSError):
+            self._replace(process)
+            raise ProcessExitedError("the worker process exited unexpectedly")
+        except asyncio.CancelledError:
+            self._replace(process)
+            raise
+        except Exception:
+            self.idle.put_nowait(process)
+            raise
+        self.idle.put_nowait(process)
+        if timings is not None and returned_timings is not None:
+            timings.update(returned_timings)
+        return results
@@ -0,0 +1,185 @@
+import asyncio
+import threading
+import time
+from collections import deque
+from functools import partial
+from hashlib import sha1
+from queue import Empty, SimpleQueue
+
+from utils.cache import to_hash
+
+
+class Entry:
+    def __init__(self, loop, element, arguments, stream=None):
+        self.loop = loop
+        self.element = element
+        self.arguments = arguments
+        self.key = to_hash(arguments, sha1)
+        self.stream = stream
+        self.future = loop.create_future()
+
+    def is_cancelled(self):
+        return self.future.done()
+
+    def _set_result(self, result):
+        if not self.future.done():
+            self.future.set_result(result)
+
+    def _set_exception(self, exc):
+        if not self.future.done():
+            self.future.set_exception(exc)
+
+    def set_result(self, result):
+        self.loop.call_soon_threadsafe(self._set_result, result)
+
+    def set_exception(self, exc):
+        self.loop.call_soon_threadsafe(self._set_exception, exc)
+
+    def send(self, text):
+        self.loop.call_soon_threadsafe(self.stream, text)
+
+
+class ThroughputMeter:
+    def __init__(self, window=10):
+        self.window = window
+        self.events = deque()
+        self.total = 0
+
+    def add(self, count):
+        now = time.monotonic()
+        self.total += count
+        self.events.append((now, count))
+        self._expire(now)
+
+    def _expire(self, now):
+        while self.events and self.events[0][0] < now - self.window:
+            self.events.popleft()
+
+    def rate(self):
+        now = time.monotonic()
+        self._expire(now)
+        if not self.events:
+            return 0.0
+        elapsed = max(now - self.events[0][0], 1e-3)
+        return sum(count for _, count in self.events) / elapsed
+
+
+class ContinuousScheduler:
+    def __init__(self, model, max_batch_size, idle_timeout=0.1):
+        assert max_batch_size > 0, "the batch size has to be at least 1"
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.idle_timeout = idle_timeout
+        self.queue = SimpleQueue()
+        self.thread = None
+        self.is_running = False
+        self.batch = None
+        self.slots = None
+        self.num_running = 0
+        self.tokens = ThroughputMeter()
+        self.steps = 0
+
+    def settings(self):
+        return {"scheduler": "continuous"}
+
+    def statistics(self):
+        return {
+            "running sequences": self.num_running,
+            "queued sequences": self.queue.qsize(),
+            "decode steps": self.steps,
+            "generated tokens": self.tokens.total,
+            "tokens per second": round(self.tokens.rate(), 2),
+        }
+
+    def startup(self):
+        if self.thread is not None:
+            raise ValueError("scheduler is already running")
+        self.batch = self.model.continuous_batch()
+        self.slots = asyncio.Semaphore(self.max_batch_size)
+        self.is_running = True
+        self.thread = threading.Thread(target=self._loop, daemon=True)
+        self.thread.start()
+
+    def shutdown(self):
+        if self.thread is None:
+            raise ValueError("scheduler is not running")
+        self.is_running = False
+        self.thread.join()
+        self.thread = None
+
+    async def reserve(self, size):
+        for _ in range(size):
+            await self.slots.acquire()
+
+    def submit(self, element, arguments, stream=None):
+        entry = Entry(asyncio.get_running_loop(), element, arguments, stream)
+        entry.future.add_done_callback(lambda _: self.slots.release())
+        self.queue.put(entry)
+        return entry.future
+
+    def _take(self, size, block):
+        entries = []
+        try:
+            if block:
+                entries.append(self.queue.get(timeout=self.idle_timeout))
+            while len(entries) < size:
+                entries.append(self.queue.get_nowait())
+        except Empty:
+            pass
+        return [entry for entry in entries if not entry.is_cancelled()]
+
+    def _admit(self, batch, entries):
+        groups = {}
+        for entry in entries:
+            groups.setdefault(entry.key, []).append(entry)
+        for group in groups.values():
+            arguments = group[0].arguments
+            if any(entry.stream is not None for entry in group):
+                arguments = {**arguments, "_stream": partial(self._send, group)}
+            try:
+                sequences, inputs = self.model.start_sequences(
+                    [entry.element for entry in group], **arguments
+                )
+                for sequence, entry in zip(sequences, group):
+                    sequence.entry = entry
+                batch.add(sequences, inputs)
+                self.tokens.add(len(sequences))
+            except Exception as e:
+                for entry in group:
+                    entry.set_exception(e)
+
+    @staticmethod
+    def _send(group, i, text):
+        if group[i].stream is not None:
+            group[i].send(text)
+
+    def _finish(self, sequences):
+        for sequence in sequences:
+            try:
+                sequence.entry.set_result(self.model.sequence_result(sequence))
+            except Exception as e:
+                sequence.entry.set_exception(e)
+
+    def _loop(self):
+        batch = self.batch
+        while self.is_running:
+            free = self.max_batch_size - len(batch)
+            if free > 0:
+                entries = self._take(free, block=len(batch) == 0)
+                if entries:
+                    self._admit(batch, entries)
+            self._finish(
+                batch.pop_finished(lambda sequence: sequence.entry.is_cancelled())
+            )
+            try:
+                self.num_running = len(batch)
+                num_generated = batch.step()
+            except Exception as e:
+                for sequence in batch.clear():
+                    sequence.entry.set_exception(e)
+                continue
+            if num_generated:
+                self.steps += 1
+                self.tokens.add(num_generated)
+        for sequence in batch.clear():
+            sequence.entry.set_exception(RuntimeError("scheduler was stopped"))
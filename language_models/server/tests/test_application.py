@@ -0,0 +1,67 @@
+import json
+from typing import List
+
+from fastapi.testclient import TestClient
+from pydantic import BaseModel
+
+from application import FuncFastAPI, ResponseHandler
+from argument_models import create_function_validator
+from payload import ResultTypes
+
+
+class Body(BaseModel):
+    batch: List[str]
+
+
+def upper(batch):
+    return [e.upper() for e in batch]
+
+
+def test_timed_response_reports_render_time():
+    handler = ResponseHandler("model")
+    timings = [{"cached": True}]
+    response = handler.result_response(ResultTypes.DONE, ["a"], True, timings=timings)
+    body = json.loads(response.body)
+    assert body["meta"]["timing"] == {"elements": timings}
+    assert response.headers["Server-Timing"].startswith("serialize;dur=")
+    untimed = handler.result_response(ResultTypes.DONE, ["a"], True)
+    assert "Server-Timing" not in untimed.headers
+
+
+def test_cache_routes_need_an_enabled_cache():
+    with TestClient(FuncFastAPI(upper, Body, model_name="model")) as client:
+        response = client.post("/cache/import", json={"entries": []})
+        assert response.status_code == 404
+        assert client.get("/cache/export").status_code == 404
+    app = FuncFastAPI(upper, Body, model_name="model", cache_size=8)
+    with TestClient(app) as client:
+        response = client.post("/cache/import", json={"entries": [["00", "A"]]})
+        assert response.json()["data"] == {"loaded": 1}
+
+
+class Trimmer:
+    def __call__(self, batch, max_new_tokens: int = 8):
+        return [e[:max_new_tokens] for e in batch]
+
+    def trim_prompt(
+        self, template, segments, instruction=None, max_length=None, max_new_tokens=None
+    ):
+        return template.format(text=" ".join(segments)), len(segments)
+
+
+def test_trimmed_route_validates_its_body():
+    model = Trimmer()
+    *_, validator = create_function_validator(
+        model, positional_arguments=[("batch", List[str])]
+    )
+    with TestClient(FuncFastAPI(model, validator, model_name="model")) as client:
+        body = {"template": "> {text}", "segments": ["a", "b"], "max_new_tokens": 3}
+        response = client.post("/trimmed", json=body)
+        assert response.json()["data"] == ["> a"]
+        assert response.json()["meta"]["segments_used"] == 2
+
+        response = client.post("/trimmed", json=["a"])
+        assert response.status_code == 422
+        response = client.post("/trimmed", json={"segments": [], "max_new_tokens": 1})
+        assert response.status_code == 422
+        assert [error["loc"] for error in response.json()["errors"]] == [["template"]]
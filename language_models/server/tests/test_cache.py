@@ -0,0 +1,66 @@
+import asyncio
+
+from test_workers import make_work, wait_until
+
+from utils.cache import Cache, DiskCache
+from utils.event import EventBox
+from workers import Workers
+
+
+def test_disk_cache_tracks_size(tmp_path):
+    disk = DiskCache(tmp_path / "cache.sqlite", 400, flush_size=4)
+    disk.set_many([(bytes([i]), "x" * i) for i in range(20)])
+    assert disk.size == disk._query_size()
+    disk.set_many([(bytes([19]), "y"), (bytes([19]), "yy"), (b"new", [1, 2, 3])])
+    assert disk.size == disk._query_size()
+    assert disk.size <= disk.max_size
+    assert disk[bytes([19])] == "yy"
+
+
+def test_disk_cache_batches_accessed_updates(tmp_path):
+    disk = DiskCache(tmp_path / "cache.sqlite", 10_000, flush_size=3)
+    disk.set_many([(b"a", 1), (b"b", 2), (b"c", 3)])
+    disk[b"c"]
+    disk[b"a"]
+    disk[b"c"]
+    assert len(disk.accessed) == 2
+    disk[b"b"]
+    assert not disk.accessed
+    assert [key for key, _ in disk.items()] == [b"a", b"c", b"b"]
+
+
+def test_cached_element_is_not_written_back(tmp_path):
+    cache = Cache(0, disk_path=tmp_path / "cache.sqlite", disk_size=10_000)
+    cache.set(["x", cache.hash({})], "X")
+    writes = []
+    cache.disk.set_many = writes.append
+    work = make_work(["x"], cache, None)
+    assert work.event_box.result == ["X"]
+    assert cache.disk_hits == 1
+    assert writes == []
+
+
+def test_batch_results_are_written_once(tmp_path):
+    async def run():
+        workers = Workers(
+            lambda batch: [e.upper() for e in batch],
+            batch_size=4,
+            disk_cache_size=10_000,
+            cache_path=tmp_path / "cache.sqlite",
+        )
+        disk = workers.cache.disk
+        writes = []
+        set_many = disk.set_many
+        disk.set_many = lambda rows: writes.append(rows) or set_many(rows)
+        workers.startup()
+        try:
+            event_box = EventBox(asyncio.Event(), None)
+            workers.submit(event_box, {"batch": ["a", "b", "c"]})
+            await event_box.wait()
+            await wait_until(lambda: writes)
+            assert [len(rows) for rows in writes] == [3]
+            assert disk[writes[0][0][0]] == "A"
+        finally:
+            workers.shutdown()
+
+    asyncio.run(run())
@@ -0,0 +1,32 @@
+import asyncio
+import os
+import time
+
+from pool import ProcessPool
+
+
+def parent(batch):
+    if batch == ["slow"]:
+        time.sleep(30)
+    return [os.getppid() for _ in batch]
+
+
+def test_cancelled_worker_is_replaced_from_template():
+    pool = ProcessPool(parent, 1)
+
+    async def run():
+        pool.startup()
+        try:
+            template_pid = pool.template.process.pid
+            assert await pool.run({"batch": [0]}) == [template_pid]
+            task = asyncio.ensure_future(pool.run({"batch": ["slow"]}))
+            await asyncio.sleep(0.5)
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            assert pool.num_restarts == 1
+            results = await asyncio.wait_for(pool.run({"batch": [0, 1]}), 5)
+            assert results == [template_pid, template_pid]
+        finally:
+            pool.shutdown()
+
+    asyncio.run(run())
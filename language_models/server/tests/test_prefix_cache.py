@@ -0,0 +1,127 @@
+import pytest
+import torch
+
+from models._prefix_cache import PrefixCache
+
+
+def make_kv(tokens):
+    values = torch.tensor(tokens, dtype=torch.float32).reshape(1, len(tokens), 1)
+    return ((values, -values),)
+
+
+def matched_tokens(kv):
+    return kv[0][0].reshape(-1).int().tolist()
+
+
+def test_insert_splits_partial_edges():
+    cache = PrefixCache(100)
+    cache.insert([1, 2, 3, 4], make_kv([1, 2, 3, 4]))
+    cache.insert([1, 2, 5, 6], make_kv([1, 2, 5, 6]))
+    (node,) = cache.root.children.values()
+    assert node.tokens == (1, 2)
+    assert sorted(child.tokens for child in node.children.values()) == [
+        (3, 4),
+        (5, 6),
+    ]
+    assert cache.size == 6
+
+    length, kv = cache.match([1, 2, 5, 6, 7])
+    assert length == 4
+    assert matched_tokens(kv) == [1, 2, 5, 6]
+    length, kv = cache.match([1, 2, 3, 9])
+    assert length == 3
+    assert matched_tokens(kv) == [1, 2, 3]
+    assert cache.match([1, 2, 3, 4])[0] == 3
+    assert cache.match([9, 1]) == (0, None)
+
+
+def test_evicts_least_recently_used_leaves():
+    cache = PrefixCache(7)
+    cache.insert([1, 2, 3, 4], make_kv([1, 2, 3, 4]))
+    cache.insert([1, 2, 5, 6], make_kv([1, 2, 5, 6]))
+    cache.match([1, 2, 3, 4, 0])
+    cache.insert([7, 8, 9], make_kv([7, 8, 9]))
+    assert cache.size == 7
+    assert cache.evicted_tokens == 2
+
+    length, kv = cache.match([1, 2, 3, 4, 0])
+    assert length == 4
+    assert matched_tokens(kv) == [1, 2, 3, 4]
+    assert cache.match([1, 2, 5, 6, 0])[0] == 2
+    length, kv = cache.match([7, 8, 9, 0])
+    assert length == 3
+    assert matched_tokens(kv) == [7, 8, 9]
+
+
+def test_eviction_removes_whole_branches():
+    cache = PrefixCache(4)
+    cache.insert([1, 2, 3], make_kv([1, 2, 3]))
+    cache.insert([4, 5, 6], make_kv([4, 5, 6]))
+    assert cache.size == 3
+    assert cache.match([1, 2, 3, 0]) == (0, None)
+    cache.insert([4, 5, 7, 8], make_kv([4, 5, 7, 8]))
+    assert cache.size == 4
+    assert cache.match([4, 5, 6, 0])[0] == 2
+    length, kv = cache.match([4, 5, 7, 8, 0])
+    assert length == 4
+    assert matched_tokens(kv) == [4, 5, 7, 8]
+
+
+@pytest.fixture(scope="module")
+def tiny_model_path(tmp_path_factory):
+    from tokenizers import (Tokenizer, decoders, models, pre_tokenizers,
+                            trainers)
+    from transformers import (GPT2Config, GPT2LMHeadModel,
+                              PreTrainedTokenizerFast)
+
+    path = tmp_path_factory.mktemp("tiny")
+    tokenizer = Tokenizer(models.BPE())
+    tokenizer.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+    tokenizer.decoder = decoders.ByteLevel()
+    trainer = trainers.BpeTrainer(
+        vocab_size=300,
+        special_tokens=["<|endoftext|>"],
+        initial_alphabet=pre_tokenizers.ByteLevel.alphabet(),
+    )
+    tokenizer.train_from_iterator(
+        ["the quick brown fox jumps over the lazy dog. " * 3] * 50, trainer
+    )
+    fast = PreTrainedTokenizerFast(
+        tokenizer_object=tokenizer,
+        eos_token="<|endoftext|>",
+        bos_token="<|endoftext|>",
+        model_max_length=128,
+    )
+    fast.save_pretrained(path)
+    torch.manual_seed(0)
+    config = GPT2Config(
+        vocab_size=len(fast),
+        n_positions=256,
+        n_embd=32,
+        n_layer=2,
+        n_head=2,
+        eos_token_id=0,
+        bos_token_id=0,
+    )
+    GPT2LMHeadModel(config).save_pretrained(path)
+    return path
+
+
+def test_prefix_cached_generation_matches_uncached(tiny_model_path):
+    from models._transformers import build_transformers_model
+
+    Model = build_transformers_model(
+        str(tiny_model_path), dtype=torch.float32, device_map=None, set_pad_token=True
+    )
+    model = Model()
+    prompts = [
+        "the quick brown fox jumps over",
+        "the quick brown fox jumps over the lazy",
+        "the quick brown dog",
+        "over the lazy dog",
+    ]
+    uncached = model(prompts, max_new_tokens=8, stopping_strings=None)
+    model.enable_prefix_cache(1000)
+    assert model(prompts, max_new_tokens=8, stopping_strings=None) == uncached
+    assert model(prompts, max_new_tokens=8, stopping_strings=None) == uncached
+    assert model.prefix_cache.hit_tokens > 0
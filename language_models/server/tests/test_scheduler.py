@@ -0,0 +1,38 @@
+import asyncio
+
+from scheduler import ContinuousScheduler, Entry
+
+
+class RecordingModel:
+    def __init__(self):
+        self.groups = []
+
+    def start_sequences(self, elements, **arguments):
+        self.groups.append(elements)
+        return [type("Sequence", (), {})() for _ in elements], None
+
+
+class RecordingBatch:
+    def add(self, sequences, inputs):
+        pass
+
+
+def test_equal_arguments_are_admitted_together():
+    async def run():
+        loop = asyncio.get_running_loop()
+        words = [f"w{i}" for i in range(12)]
+        filler = {f"x{i}" for i in range(200)}
+        stopping = set(words)
+        reordered = set(words) | filler
+        reordered -= filler
+        model = RecordingModel()
+        scheduler = ContinuousScheduler(model, 4)
+        entries = [
+            Entry(loop, "a", {"stopping_strings": {"exclusive": stopping}}),
+            Entry(loop, "b", {"stopping_strings": {"exclusive": reordered}}),
+            Entry(loop, "c", {"stopping_strings": {"exclusive": {"w0"}}}),
+        ]
+        scheduler._admit(RecordingBatch(), entries)
+        assert model.groups == [["a", "b"], ["c"]]
+
+    asyncio.run(run())
@@ -0,0 +1,78 @@
+import random
+
+from models._stopping_criteria import StringStoppingCriteria
+from models._string_matcher import StringMatcher
+
+
+def naive_stop(inclusive, exclusive, tokens):
+    decoded = ""
+    for i, token in enumerate(tokens):
+        decoded += token
+        for strings, remove in ((exclusive, True), (inclusive, False)):
+            for string in strings:
+                if string in decoded[-(len(string) + len(token) - 1) :]:
+                    return i, string, remove
+    return None
+
+
+def matcher_stop(inclusive, exclusive, tokens):
+    criteria = StringStoppingCriteria(None, inclusive=inclusive, exclusive=exclusive)
+    for i, token in enumerate(tokens):
+        if criteria.should_stop(token):
+            return i, criteria.stop_string, criteria.remove
+    return None
+
+
+def test_overlapping_patterns():
+    for tokens in (["u", "s", "h", "e", "r", "s"], ["ushers"], ["us", "he", "rs"]):
+        inclusive = ["he", "she", "hers"]
+        assert (
+            matcher_stop(inclusive, [], tokens)[0]
+            == naive_stop(inclusive, [], tokens)[0]
+        )
+    assert matcher_stop(["abcd", "bc"], [], ["a", "b", "c", "d"]) == (2, "bc", False)
+    assert matcher_stop(["aab"], [], ["a", "a", "a", "b"]) == (3, "aab", False)
+
+
+def test_match_spanning_tokens():
+    tokens = ["foo <", "/", "s> bar"]
+    assert matcher_stop([], ["</s>"], tokens) == naive_stop([], ["</s>"], tokens)
+    assert matcher_stop([], ["</s>"], tokens) == (2, "</s>", True)
+    assert matcher_stop([], ["</s>"], ["<", "/", "x>", "</", "s>"]) == (
+        4,
+        "</s>",
+        True,
+    )
+
+
+def test_exclusive_wins_over_inclusive():
+    assert matcher_stop(["a"], ["b"], ["xab"]) == (0, "b", True)
+    assert matcher_stop(["a"], ["b"], ["xba"]) == (0, "b", True)
+    assert matcher_stop(["a"], ["b"], ["xa"]) == (0, "a", False)
+    assert matcher_stop(["ab"], ["b"], ["a", "b"]) == naive_stop(
+        ["ab"], ["b"], ["a", "b"]
+    )
+
+
+def test_empty_stop_strings_are_ignored():
+    assert StringMatcher([""], [""]).is_empty()
+    assert matcher_stop([""], [], ["a", "b"]) is None
+    assert matcher_stop(["", "b"], [""], ["a", "b"]) == (1, "b", False)
+
+
+def test_agrees_with_naive_check():
+    rng = random.Random(0)
+    for _ in range(500):
+        strings = {
+            "".join(rng.choices("abc", k=rng.randint(1, 4)))
+            for _ in range(rng.randint(1, 4))
+        }
+        exclusive = set(rng.sample(sorted(strings), rng.randint(0, len(strings))))
+        inclusive = strings - exclusive
+        tokens = ["".join(rng.choices("abcd", k=rng.randint(1, 3))) for _ in range(20)]
+        expected = naive_stop(inclusive, exclusive, tokens)
+        result = matcher_stop(inclusive, exclusive, tokens)
+        if expected is None:
+            assert result is None
+        else:
+            assert result[0] == expected[0] and result[2] == expected[2]
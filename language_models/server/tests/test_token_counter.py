@@ -0,0 +1,29 @@
+from models._token_counter import TokenCounter
+
+
+class LengthCounter(TokenCounter):
+    def _count(self, documents, indicate_shared):
+        return [
+            {"counts": len(texts), "num": {"all": len(texts)}} for texts in documents
+        ]
+
+
+def test_repeated_uncached_documents_are_misses():
+    counter = LengthCounter(None)
+    results = counter.batch(["ab", "ab", "abc"])
+    assert [result["counts"] for result in results] == [2, 2, 3]
+    assert counter.statistics() == {
+        "token count cache hits": 0,
+        "token count cache misses": 3,
+    }
+    counter.batch(["ab", "abcd"])
+    assert counter.hits == 1 and counter.misses == 4
+
+
+def test_results_do_not_share_cached_entries():
+    counter = LengthCounter(None)
+    first, second = counter.batch(["ab", "ab"])
+    first["num"]["all"] = 100
+    second["counts"] = 100
+    (cached,) = counter.batch(["ab"])
+    assert cached == {"counts": 2, "num": {"all": 2}}
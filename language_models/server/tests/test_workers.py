@@ -0,0 +1,182 @@
+import asyncio
+import threading
+
+from controller import AdaptiveController
+from payload import ResultTypes
+from utils.cache import Cache
+from utils.event import EventBox
+from workers import Batcher, SingleFlight, Work, Workers
+
+
+def make_work(batch, cache, single_flight):
+    event_box = EventBox(asyncio.Event(), None)
+    return Work(event_box, {"batch": batch}, cache, single_flight=single_flight)
+
+
+def test_resolved_handoff_is_not_batched():
+    async def run():
+        cache = Cache(0)
+        batcher = Batcher(1)
+
+        def requeue(work, i):
+            work.requeue(i)
+            if not work.is_queued:
+                batcher.add(work)
+
+        single_flight = SingleFlight(requeue)
+        leader = make_work(["x"], cache, single_flight)
+        follower = make_work(["x", "y"], cache, single_flight)
+        batcher.add(leader)
+        batcher.add(follower)
+        batches = batcher.consume()
+        leader_targets, _ = await anext(batches)
+        follower_targets, _ = await anext(batches)
+        assert follower_targets.elements == ["y"]
+
+        leader.event_box.disconnect_event.set()
+        single_flight.release(leader)
+        assert follower.num_pending() == 1
+        leader_targets.add_processed(["X"])
+        assert follower.results[0] == "X"
+        assert follower.num_pending() == 0
+
+        other = make_work(["z"], cache, single_flight)
+        batcher.add(other)
+        targets, data = await asyncio.wait_for(anext(batches), 1)
+        assert data["batch"] == ["z"]
+        assert len(targets) == 1
+        follower_targets.add_processed(["Y"])
+        assert follower.event_box.result == ["X", "Y"]
+
+    asyncio.run(run())
+
+
+async def wait_until(condition, timeout=5):
+    async def poll():
+        while not condition():
+            await asyncio.sleep(0.01)
+
+    await asyncio.wait_for(poll(), timeout)
+
+
+def test_lowered_concurrency_drains_running_batches():
+    async def run():
+        gates = {element: threading.Event() for element in "abcd"}
+        started = []
+
+        def func(batch):
+            started.append(batch[0])
+            gates[batch[0]].wait()
+            return batch
+
+        controller = AdaptiveController(1.0, 1, 3)
+        workers = Workers(func, num_threads=3, batch_size=1, controller=controller)
+        workers.startup()
+        try:
+            event_boxes = []
+            for element in "abcd":
+                event_box = EventBox(asyncio.Event(), None)
+                workers.submit(event_box, {"batch": [element]})
+                event_boxes.append(event_box)
+            await wait_until(lambda: len(started) == 3)
+
+            controller.concurrency = 1
+            workers._apply_controller()
+            gates[started[0]].set()
+            await wait_until(lambda: workers.num_running_threads() == 2)
+            await asyncio.sleep(0.05)
+            assert len(started) == 3
+
+            for element in started:
+                gates[element].set()
+            await wait_until(lambda: len(started) == 4)
+            gates[started[3]].set()
+            await asyncio.gather(*(event_box.wait() for event_box in event_boxes))
+            assert [event_box.result for event_box in event_boxes] == [
+                [e] for e in "abcd"
+            ]
+        finally:
+            for gate in gates.values():
+                gate.set()
+            workers.shutdown()
+
+    asyncio.run(run())
+
+
+def test_follower_expires_at_its_own_deadline():
+    async def run():
+        gate = threading.Event()
+
+        def func(batch):
+            gate.wait()
+            return batch
+
+        workers = Workers(func, batch_size=1)
+        workers.startup()
+        try:
+            leader = EventBox(asyncio.Event(), None)
+            follower = EventBox(asyncio.Event(), None)
+            workers.submit(leader, {"batch": ["a"]})
+            workers.submit(follower, {"batch": ["a"]}, timeout="0.2")
+            await asyncio.wait_for(follower.wait(), 2)
+            assert follower.result_type == ResultTypes.EXPIRED
+            (flight,) = workers.single_flight.flights.values()
+            assert [work.event_box for work, _ in flight] == [leader]
+
+            gate.set()
+            await leader.wait()
+            assert leader.result == ["a"]
+        finally:
+            gate.set()
+            workers.shutdown()
+
+    asyncio.run(run())
+
+
+class StubScheduler:
+    def __init__(self):
+        self.futures = {}
+
+    def settings(self):
+        return {}
+
+    def statistics(self):
+        return {}
+
+    def startup(self):
+        pass
+
+    def shutdown(self):
+        pass
+
+    async def reserve(self, size):
+        pass
+
+    def submit(self, element, arguments, stream=None):
+        future = self.futures[element] = asyncio.get_running_loop().create_future()
+        return future
+
+
+def test_continuous_batch_cancels_finished_work():
+    async def run():
+        scheduler = StubScheduler()
+        workers = Workers(lambda batch: batch, batch_size=2, scheduler=scheduler)
+        workers.startup()
+        try:
+            abandoned = EventBox(asyncio.Event(), None)
+            kept = EventBox(asyncio.Event(), None)
+            workers.submit(abandoned, {"batch": ["a"]})
+            workers.submit(kept, {"batch": ["b"]})
+            await wait_until(lambda: len(scheduler.futures) == 2)
+
+            abandoned.disconnect_event.set()
+            await wait_until(lambda: scheduler.futures["a"].cancelled())
+            assert not scheduler.futures["b"].done()
+
+            scheduler.futures["b"].set_result("B")
+            await kept.wait()
+            assert kept.result == ["B"]
+        finally:
+            workers.shutdown()
+
+    asyncio.run(run())
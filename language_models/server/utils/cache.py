@@ -1,79 +1,84 @@
+import json
+import sqlite3
+import threading
+import time
 from hashlib import sha1
-from itertools import chain
+from pathlib import Path
 
 from cachetools import LRUCache
 
-
-def interleave(l, value):
-    l = iter(l)
-    try:
-        e = next(l)
-        yield e
-        while e := next(l):
-            yield value
-            yield e
-    except StopIteration:
-        pass
-
-
-def chain_interleave(l, value):
-    yield from chain.from_iterable(interleave(l, (value,)))
-
+from utils.aio import to_thread
 
 ESCAPE_CHARS = [b"'", b",", b"[", b"]", b"{", b"}", b"(", b")"]
 REPLACEMENTS = [(e, b"\\" + e) for e in ESCAPE_CHARS]
 
 
-def _bytes(data):
+def _escape(data):
     data = data.replace(b"\\", b"\\\\")
     for char, repl in REPLACEMENTS:
         data = data.replace(char, repl)
-    yield b"'"
-    yield data
-    yield b"'"
+    return data
 
 
-def _str_bytes(data):
-    yield from _bytes(str(data).encode())
+def _bytes(data, out):
+    out += (b"'", _escape(data), b"'")
 
 
-def _list_bytes(data):
-    yield b"["  # ]
-    yield from chain_interleave(map(to_bytes, data), b",")
+def _str_bytes(data, out):
+    _bytes(str(data).encode(), out)
+
+
+def _list_bytes(data, out):
+    out.append(b"[")  # ]
+    for i, e in enumerate(data):
+        if i:
+            out.append(b",")
+        _encode(e, out)
     # [
-    yield b"]"
+    out.append(b"]")
 
 
-def _set_bytes(data):
-    iterator = (list(to_bytes(e)) for e in data)
-    iterator = sorted(iterator)
-    yield b"{"  # }
-    yield from chain_interleave(iterator, b",")
-    # {
-    yield b"}"
+def _sorted_encoded(data):
+    encoded = []
+    for e in data:
+        chunks = []
+        _encode(e, chunks)
+        encoded.append(chunks)
+    return sorted(encoded)
 
 
-def _dict_entry(key, value):
-    yield b"("  # ")"
-    yield from key
-    yield b":"
-    yield from value
-    # "("
-    yield b")"
+def _set_bytes(data, out):
+    out.append(b"{")  # }
+    for i, chunks in enumerate(_sorted_encoded(data)):
+        if i:
+            out.append(b",")
+        out += chunks
+    # {
+    out.append(b"}")
 
 
-def _dict_bytes(data):
-    iterator = [(list(to_bytes(key)), value) for key, value in data.items()]
-    iterator = sorted(iterator, key=lambda x: x[0])
-    iterator = (_dict_entry(key, to_bytes(value)) for key, value in iterator)
-    iterator = chain_interleave(iterator, b",")
-    yield b"{"  # }
-    yield from iterator
-    yield b"}"
+def _dict_bytes(data, out):
+    entries = []
+    for key, value in data.items():
+        chunks = []
+        _encode(key, chunks)
+        entries.append((chunks, value))
+    entries.sort(key=lambda x: x[0])
+    out.append(b"{")  # }
+    for i, (key, value) in enumerate(entries):
+        if i:
+            out.append(b",")
+        out.append(b"(")  # )
+        out += key
+        out.append(b":")
+        _encode(value, out)
+        # (
+        out.append(b")")
+    out.append(b"}")
 
 
-def _none_bytes(_):
-    return b""
+def _none_bytes(_, out):
+    pass
 
 
 TYPES = {
@@ -88,40 +93,256 @@ TYPES = {
     type(None): (b"None", _none_bytes),
 }
 
+FAST_TYPES = {
+    data_type: entry for data_type, entry in TYPES.items() if data_type is not str
+}
+
 
-def to_bytes(data):
-    data_type = type(data).mro()[-2]
+def _encode(data, out):
+    data_type = type(data)
+    if data_type is str:
+        out += (b"str'", _escape(data.encode()), b"'")
+        return
     try:
-        prefix, serializer = TYPES[data_type]
-        yield prefix
-        yield from serializer(data)
+        prefix, serializer = FAST_TYPES[data_type]
     except KeyError:
-        raise ValueError(f"unsupported type {data_type}")
+        data_type = data_type.mro()[-2]
+        try:
+            prefix, serializer = TYPES[data_type]
+        except KeyError:
+            raise ValueError(f"unsupported type {data_type}")
+    out.append(prefix)
+    serializer(data, out)
+
+
+def to_bytes(data):
+    out = []
+    _encode(data, out)
+    return b"".join(out)
 
 
 def to_hash(data, hash_function):
-    hasher = hash_function()
-    for b in to_bytes(data):
-        hasher.update(b)
-    return hasher.digest()
+    return hash_function(to_bytes(data)).digest()
+
+
+class DiskCache:
+    def __init__(self, path, max_size, flush_size=256):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_size = max_size
+        self.flush_size = flush_size
+        self.accessed = {}
+        self.lock = threading.RLock()
+        self.connection = sqlite3.connect(
+            self.path, check_same_thread=False, isolation_level=None
+        )
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS entries (key BLOB PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, accessed REAL NOT NULL)"
+        )
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)"
+        )
+        self.size = self._query_size()
+
+    def _query_size(self):
+        (size,) = self.connection.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM entries"
+        ).fetchone()
+        return size
+
+    def __len__(self):
+        with self.lock:
+            (count,) = self.connection.execute(
+                "SELECT COUNT(*) FROM entries"
+            ).fetchone()
+        return count
+
+    def __getitem__(self, key):
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT value FROM entries WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                raise KeyError(key)
+            self.accessed[key] = time.time()
+            if len(self.accessed) >= self.flush_size:
+                with self.connection:
+                    self._flush_accessed()
+        return json.loads(row[0])
+
+    def _flush_accessed(self):
+        if self.accessed:
+            self.connection.executemany(
+                "UPDATE entries SET accessed = ? WHERE key = ?",
+                [(accessed, key) for key, accessed in self.accessed.items()],
+            )
+            self.accessed = {}
+
+    def _query_sizes(self, keys):
+        sizes = {}
+        for i in range(0, len(keys), 512):
+            chunk = keys[i : i + 512]
+            placeholders = ", ".join("?" * len(chunk))
+            sizes.update(
+                self.connection.execute(
+                    f"SELECT key, size FROM entries WHERE key IN ({placeholders})",
+                    chunk,
+                )
+            )
+        return sizes
+
+    def __setitem__(self, key, value):
+        self.set_many([(key, value)])
+
+    def set_many(self, items):
+        rows = {}
+        for key, value in items:
+            value = json.dumps(value)
+            rows[key] = (key, value, len(key) + len(value), time.time())
+        with self.lock:
+            with self.connection:
+                replaced = self._query_sizes(list(rows))
+                self.connection.executemany(
+                    "INSERT OR REPLACE INTO entries (key, value, size, accessed) VALUES (?, ?, ?, ?)",
+                    rows.values(),
+                )
+                self._flush_accessed()
+            self.size += sum(row[2] for row in rows.values()) - sum(replaced.values())
+            self.evict()
+
+    def evict(self):
+        with self.lock:
+            if self.size > self.max_size:
+                with self.connection:
+                    self._flush_accessed()
+            while self.size > self.max_size:
+                rows = self.connection.execute(
+                    "SELECT key, size FROM entries ORDER BY accessed LIMIT 64"
+                ).fetchall()
+                if not rows:
+                    break
+                removed = []
+                for key, size in rows:
+                    if self.size <= self.max_size:
+                        break
+                    removed.append((key,))
+                    self.size -= size
+                with self.connection:
+                    self.connection.executemany(
+                        "DELETE FROM entries WHERE key = ?", removed
+                    )
+
+    def items(self):
+        with self.lock:
+            with self.connection:
+                self._flush_accessed()
+            rows = self.connection.execute(
+                "SELECT key, value FROM entries ORDER BY accessed"
+            ).fetchall()
+        for key, value in rows:
+            yield key, json.loads(value)
 
 
 class Cache:
-    def __init__(self, cache_size, hash_function=sha1):
-        self.enabled = cache_size > 0
+    def __init__(self, cache_size, hash_function=sha1, disk_path=None, disk_size=0):
         self.cache = LRUCache(cache_size)
+        self.disk = None
+        if disk_path is not None and disk_size > 0:
+            self.disk = DiskCache(disk_path, disk_size)
+        self.enabled = cache_size > 0 or self.disk is not None
         self.hash_function = hash_function
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
 
     def hash(self, key):
         if not self.enabled:
             return b""
         return to_hash(key, self.hash_function)
 
+    def settings(self):
+        return {
+            "cache size": self.cache.maxsize,
+            "disk cache size": self.disk.max_size if self.disk is not None else 0,
+        }
+
+    def statistics(self):
+        lookups = self.hits + self.misses
+        statistics = {
+            "items in cache": self.cache.currsize,
+            "cache hits": self.hits,
+            "cache misses": self.misses,
+            "cache hit rate": self.hits / lookups if lookups else 0.0,
+        }
+        if self.disk is not None:
+            statistics["items in disk cache"] = len(self.disk)
+            statistics["bytes in disk cache"] = self.disk.size
+            statistics["disk cache hits"] = self.disk_hits
+        return statistics
+
+    def _set_memory(self, hashed, value):
+        if self.cache.maxsize > 0:
+            self.cache[hashed] = value
+
+    def _set_memory_many(self, items):
+        if not self.enabled:
+            return []
+        rows = [(to_hash(key, self.hash_function), value) for key, value in items]
+        for hashed, value in rows:
+            self._set_memory(hashed, value)
+        return rows
+
     def set(self, key, value):
-        if self.enabled:
-            self.cache[to_hash(key, self.hash_function)] = value
+        self.set_many([(key, value)])
+
+    def set_many(self, items):
+        rows = self._set_memory_many(items)
+        if rows and self.disk is not None:
+            self.disk.set_many(rows)
+
+    async def set_many_in_thread(self, items):
+        rows = self._set_memory_many(items)
+        if rows and self.disk is not None:
+            await to_thread(self.disk.set_many, rows)
 
     def get(self, key):
         if not self.enabled:
             raise KeyError()
-        return self.cache[to_hash(key, self.hash_function)]
+        hashed = to_hash(key, self.hash_function)
+        try:
+            value = self.cache[hashed]
+        except KeyError:
+            if self.disk is None:
+                self.misses += 1
+                raise
+            try:
+                value = self.disk[hashed]
+            except KeyError:
+                self.misses += 1
+                raise
+            self.disk_hits += 1
+            self._set_memory(hashed, value)
+        self.hits += 1
+        return value
+
+    def export(self):
+        entries = {}
+        if self.disk is not None:
+            entries.update(self.disk.items())
+        entries.update(self.cache.items())
+        return [[key.hex(), value] for key, value in entries.items()]
+
+    def load(self, entries):
+        if not self.enabled:
+            raise ValueError("the cache is disabled")
+        entries = [(bytes.fromhex(key), value) for key, value in entries]
+        for key, value in entries:
+            self._set_memory(key, value)
+        if self.disk is not None:
+            self.disk.set_many(entries)
+        return len(entries)
+
+    def load_file(self, path):
+        return self.load(json.loads(Path(path).read_text()))
@@ -12,6 +12,8 @@ class EventBox:
         self.result = None
         self.result_type = None
         self.response_handler = response_hander
+        self.timings = None
+        self.meta = None
 
     def _set_result(self, result, result_type):
         self.result = result
@@ -27,6 +29,17 @@ class EventBox:
     def set_application_error(self, error):
         self._set_result(error, ResultTypes.APPLICATION_ERROR)
 
+    def set_overloaded(self, message, retry_after):
+        self._set_result(
+            {"message": message, "retry_after": retry_after}, ResultTypes.OVERLOADED
+        )
+
+    def set_expired(self, message):
+        self._set_result(message, ResultTypes.EXPIRED)
+
+    def is_overloaded(self):
+        return self.result_type == ResultTypes.OVERLOADED
+
     def events(self):
         return self.result_event, self.disconnect_event
 
@@ -40,4 +53,4 @@ class EventBox:
         if self.disconnect_event.is_set():
             self.result_type = ResultTypes.DISCONNECTED
             self.result = None
-        return self.response_handler.result_response(self.result_type, self.result, to_response=to_response)
+        return self.response_handler.result_response(self.result_type, self.result, to_response=to_response, timings=self.timings, meta=self.meta)
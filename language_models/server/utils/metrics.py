@@ -0,0 +1,142 @@
+import math
+
+LATENCY_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+    120.0,
+    300.0,
+)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels) + "}"
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Metric:
+    TYPE = None
+
+    def __init__(self, name, documentation, function=None):
+        self.name = name
+        self.documentation = documentation
+        self.function = function
+        self.values = {}
+
+    @staticmethod
+    def _key(labels):
+        return tuple(sorted(labels.items()))
+
+    def samples(self):
+        if self.function is not None:
+            yield self.name, (), self.function()
+        for labels, value in self.values.items():
+            yield self.name, labels, value
+
+    def render(self):
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.TYPE}",
+        ]
+        for name, labels, value in self.samples():
+            lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return lines
+
+
+class Counter(Metric):
+    TYPE = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    TYPE = "gauge"
+
+    def set(self, value, **labels):
+        self.values[self._key(labels)] = value
+
+
+class Histogram(Metric):
+    TYPE = "histogram"
+
+    def __init__(self, name, documentation, buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation)
+        self.buckets = (*sorted(buckets), math.inf)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        try:
+            counts, total = self.values[key]
+        except KeyError:
+            counts, total = [0] * len(self.buckets), 0.0
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[i] += 1
+                break
+        self.values[key] = counts, total + value
+
+    def samples(self):
+        for labels, (counts, total) in self.values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                yield (
+                    f"{self.name}_bucket",
+                    (*labels, ("le", _format_value(bound))),
+                    cumulative,
+                )
+            yield f"{self.name}_sum", labels, total
+            yield f"{self.name}_count", labels, cumulative
+
+
+class Registry:
+    def __init__(self, prefix=None):
+        self.prefix = prefix
+        self.metrics = []
+
+    def _add(self, metric_class, name, *args, **kwargs):
+        if self.prefix is not None:
+            name = f"{self.prefix}_{name}"
+        metric = metric_class(name, *args, **kwargs)
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, function=None):
+        return self._add(Counter, name, documentation, function=function)
+
+    def gauge(self, name, documentation, function=None):
+        return self._add(Gauge, name, documentation, function=function)
+
+    def histogram(self, name, documentation, buckets=LATENCY_BUCKETS):
+        return self._add(Histogram, name, documentation, buckets=buckets)
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
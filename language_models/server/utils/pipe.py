@@ -1,6 +1,5 @@
 import asyncio
 from collections import deque
-from queue import Empty, PriorityQueue
 
 
 class Pipe:
@@ -39,33 +38,25 @@ class Pipe:
 
 class SortedPipe:
     def __init__(self):
-        self.queue = PriorityQueue()
-        self.added_event = asyncio.Event()
-        self.element_count = 0
+        self.pending = {}
+        self.has_next = asyncio.Event()
         self.yield_count = 0
 
-    def next_index(self):
-        element_count = self.element_count
-        self.element_count += 1
-        return element_count
+    def __len__(self):
+        return len(self.pending)
 
     def add(self, pos, element):
-        self.queue.put((pos, element))
-        self.added_event.set()
+        self.pending[pos] = element
+        if pos == self.yield_count:
+            self.has_next.set()
 
     async def get(self):
-        while True:
-            await self.added_event.wait()
-            try:
-                count, entry = self.queue.get_nowait()
-                if count == self.yield_count:
-                    self.yield_count += 1
-                    return entry
-                else:
-                    self.queue.put((count, entry))
-                    self.added_event.clear()
-            except Empty:
-                self.added_event.clear()
+        await self.has_next.wait()
+        entry = self.pending.pop(self.yield_count)
+        self.yield_count += 1
+        if self.yield_count not in self.pending:
+            self.has_next.clear()
+        return entry
 
     async def drain(self):
         while True:
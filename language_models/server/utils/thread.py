@@ -1,6 +1,7 @@
 import asyncio
 
 import kthread
+
 from utils.aio import to_thread, wait_first
 
 
@@ -25,6 +26,9 @@ class CancableThread(kthread.KThread):
                 self.terminate()
             raise
 
+    async def run_until_finish(self):
+        return await self._run_async()
+
     async def run_until_finish_or_event(self, event):
         result, _ = await wait_first([self._run_async(), event.wait()])
         return result
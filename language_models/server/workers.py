@@ -1,60 +1,330 @@
 import asyncio
+import inspect
+import math
+import time
+from collections import deque
+from functools import partial
 
+from pool import ProcessExitedError
 from utils.aio import to_future
-from utils.cache import Cache
-from utils.pipe import Pipe
+from utils.cache import Cache, to_bytes
+from utils.metrics import Registry
 from utils.thread import CancableThread
 
+PRIORITY_WEIGHTS = {"interactive": 8, "default": 4, "batch": 1}
+DEFAULT_PRIORITY = "default"
+DEFAULT_CLIENT = "anonymous"
+MAX_RETRY_AFTER = 600
+
+
+class Flow:
+    def __init__(self, weight):
+        self.weight = weight
+        self.works = deque()
+        self.tag = 0.0
+
+    def __len__(self):
+        return len(self.works)
+
 
 class Batcher:
-    def __init__(self, batch_size):
+    def __init__(self, batch_size, token_budget=0, wait_window=100, queue_wait=None):
         assert batch_size > 0, "the batch size has to be at least 1"
         self.batch_size = batch_size
-        self.num_elements = 0
-        self.num_staging = 0
-        self.pipe = Pipe()
+        self.queue_wait = queue_wait
+        self.token_budget = token_budget
+        self.num_tokens = 0
+        self.num_padded_tokens = 0
+        self.flows = {}
+        self.virtual_time = 0.0
+        self.has_next = asyncio.Event()
+        self.num_coalesced = 0
+        self.waits = {
+            priority: deque(maxlen=wait_window) for priority in PRIORITY_WEIGHTS
+        }
 
-    def make_batches(self, l):
-        l = list(l)
-        for i in range(0, len(l), self.batch_size):
-            yield l[i : i + self.batch_size]
+    def works(self):
+        return [work for flow in self.flows.values() for work in flow.works]
 
     def num_waiting_requests(self):
-        return len(self.pipe)
+        return sum(len(flow) for flow in self.flows.values())
 
     def num_waiting_elements(self):
-        return sum(len(e) for e in self.pipe) + self.num_staging
+        return sum(work.num_pending() for work in self.works())
+
+    def num_waiting_tokens(self):
+        return sum(work.num_pending_tokens() for work in self.works())
+
+    def statistics(self):
+        statistics = {
+            "coalesced batches": self.num_coalesced,
+            "padded token ratio": (
+                round(self.num_padded_tokens / self.num_tokens, 4)
+                if self.num_tokens
+                else 0.0
+            ),
+        }
+        for priority in PRIORITY_WEIGHTS:
+            works = [work for work in self.works() if work.priority == priority]
+            waits = self.waits[priority]
+            statistics[f"waiting requests ({priority})"] = len(works)
+            statistics[f"waiting elements ({priority})"] = sum(
+                work.num_pending() for work in works
+            )
+            statistics[f"mean wait seconds ({priority})"] = (
+                round(sum(waits) / len(waits), 4) if waits else 0.0
+            )
+            statistics[f"longest wait seconds ({priority})"] = round(
+                max((work.wait_time() for work in works), default=0.0), 4
+            )
+        return statistics
 
     def add(self, work):
-        self.pipe.add(work)
+        key = (work.priority, work.client)
+        try:
+            flow = self.flows[key]
+        except KeyError:
+            flow = self.flows[key] = Flow(PRIORITY_WEIGHTS[work.priority])
+        if not flow.works:
+            flow.tag = max(flow.tag, self.virtual_time)
+        work.is_queued = True
+        flow.works.append(work)
+        self.has_next.set()
+
+    def _next_flow(self):
+        selected = None
+        for key, flow in list(self.flows.items()):
+            while flow.works and (
+                flow.works[0].is_done() or not flow.works[0].num_pending()
+            ):
+                flow.works.popleft().is_queued = False
+            if not flow.works:
+                if flow.tag <= self.virtual_time:
+                    del self.flows[key]
+            elif selected is None or flow.tag < selected.tag:
+                selected = flow
+        return selected
+
+    def _take(self, flow, work, targets):
+        wait_time = work.wait_time()
+        self.waits[work.priority].append(wait_time)
+        if self.queue_wait is not None:
+            self.queue_wait.observe(wait_time, priority=work.priority)
+        max_length = max((other.length(i) for other, i, _ in targets), default=0)
+        taken = work.take(
+            self.batch_size - len(targets), self.token_budget, len(targets), max_length
+        )
+        flow.tag += len(taken) / flow.weight
+        targets.extend((work, i, element) for i, element in taken)
+
+    def _coalesce(self, work, targets):
+        for flow in sorted(self.flows.values(), key=lambda flow: flow.tag):
+            for other in flow.works:
+                if len(targets) >= self.batch_size:
+                    return
+                if (
+                    other is not work
+                    and other.num_pending()
+                    and other.arguments_key == work.arguments_key
+                    and not other.is_done()
+                ):
+                    self._take(flow, other, targets)
 
     async def consume(self):
-        async for work in self.pipe.drain():
-            self.num_staging = work.remaining
-            arguments = work.arguments
-            remaining = work.get_remaining()
-            for batch in self.make_batches(remaining):
-                indices, batch = zip(*batch)
-                if work.is_done():
-                    break
-                self.num_staging -= len(batch)
-                yield work, indices, {"batch": list(batch), **arguments}
-            del work
-            self.num_staging = 0
+        while True:
+            await self.has_next.wait()
+            flow = self._next_flow()
+            if flow is None:
+                self.has_next.clear()
+                continue
+            work = flow.works[0]
+            self.virtual_time = flow.tag
+            targets = []
+            self._take(flow, work, targets)
+            if not targets:
+                continue
+            if len(targets) < self.batch_size:
+                self._coalesce(work, targets)
+            targets = BatchTargets(targets)
+            if len(targets.works) > 1:
+                self.num_coalesced += 1
+            lengths = targets.lengths()
+            self.num_tokens += sum(lengths)
+            self.num_padded_tokens += max(lengths) * len(lengths)
+            yield targets, {"batch": targets.elements, **work.arguments}
+            del work, targets
+
+
+class BatchTargets:
+    def __init__(self, targets):
+        self.targets = [(work, i) for work, i, _ in targets]
+        self.elements = [element for _, _, element in targets]
+        self.works = list(dict.fromkeys(work for work, _, _ in targets))
+        self.formed = time.monotonic()
+        self.cancelled = set()
+
+    def __len__(self):
+        return len(self.targets)
+
+    def lengths(self):
+        return [work.length(i) for work, i in self.targets]
+
+    def is_done(self):
+        return all(work.is_done() for work in self.works)
+
+    async def wait(self):
+        await asyncio.gather(*(work.event_box.wait() for work in self.works))
+
+    def has_timing(self):
+        return any(work.timings is not None for work in self.works)
+
+    def add_timings(self, start, elapsed, timings=None):
+        for work, i in self.targets:
+            if work.timings is not None and work.timings[i] is not None:
+                work.timings[i].update(
+                    batch_formation=start - self.formed, compute=elapsed
+                )
+                if timings:
+                    work.timings[i].update(timings)
+
+    def has_stream(self):
+        return any(work.stream is not None for work in self.works)
+
+    def stream(self, i, text):
+        work, index = self.targets[i]
+        if work.stream is not None:
+            work.stream(index, text)
+
+    def cancel(self, i):
+        work, _ = self.targets[i]
+        if work.is_done():
+            self.cancelled.add(i)
+            return True
+        return False
+
+    def add_processed(self, results):
+        entries = []
+        for j, ((work, i), result) in enumerate(zip(self.targets, results)):
+            if j in self.cancelled:
+                continue
+            entries.append((work.cache_key(i), result))
+            if work.is_done() or work.is_set[i]:
+                work.share(i, result)
+            else:
+                work.add_processed(i, result)
+        return entries
+
+    def set_error(self, message):
+        for work in self.works:
+            work.set_error(message)
+
+    def set_application_error(self, message):
+        for work in self.works:
+            work.set_application_error(message)
+
+
+class SingleFlight:
+    def __init__(self, requeue):
+        self.requeue = requeue
+        self.flights = {}
+        self.num_deduplicated = 0
+        self.num_handoffs = 0
+
+    def statistics(self):
+        return {
+            "in-flight keys": len(self.flights),
+            "deduplicated elements": self.num_deduplicated,
+            "orphan hand-offs": self.num_handoffs,
+        }
+
+    def register(self, work, remaining):
+        leaders = []
+        for i, element in remaining:
+            key = work.element_key(i)
+            try:
+                self.flights[key].append((work, i))
+                self.num_deduplicated += 1
+            except KeyError:
+                self.flights[key] = [(work, i)]
+                leaders.append((i, element))
+        return leaders
+
+    def resolve(self, key, instance):
+        for work, i in self.flights.pop(key, []):
+            if not work.is_done() and not work.is_set[i]:
+                work.discard_pending(i)
+                work.set_processed(i, instance)
+
+    def release(self, work):
+        for i, key in work.keys.items():
+            try:
+                flight = self.flights[key]
+            except KeyError:
+                continue
+            leader = flight[0]
+            flight[:] = [
+                (other, j)
+                for other, j in flight
+                if other is not work and not other.is_done()
+            ]
+            if not flight:
+                del self.flights[key]
+            elif flight[0] != leader:
+                self.num_handoffs += 1
+                self.requeue(*flight[0])
 
 
 class Work:
-    def __init__(self, event_box, data, cache):
+    def __init__(
+        self,
+        event_box,
+        data,
+        cache,
+        stream=None,
+        priority=DEFAULT_PRIORITY,
+        client=DEFAULT_CLIENT,
+        input_lengths=None,
+        single_flight=None,
+        max_input_length=0,
+        timing=False,
+    ):
         self.event_box = event_box
+        self.submitted = time.monotonic()
+        self.single_flight = single_flight
+        self.is_queued = False
+        self.expiry = None
+        self.keys = {}
+        self.stream = stream
+        self.priority = priority
+        self.client = client
+        self.waiting_since = time.monotonic()
         self.arguments = data.copy()
         self.batch = self.arguments["batch"]
         del self.arguments["batch"]
         self.remaining = len(self)
         self.results = [None] * len(self)
         self.is_set = [False] * len(self)
+        self.timings = [None] * len(self) if timing else None
+        event_box.timings = self.timings
         self.cache = cache
         self.arguments_hash = self.cache.hash(self.arguments)
+        self.arguments_key = to_bytes(self.arguments)
         self.add_cached()
+        remaining = self.get_remaining()
+        if self.single_flight is not None:
+            remaining = self.single_flight.register(self, remaining)
+        self.lengths = {}
+        self.overflowing = []
+        if input_lengths is not None and remaining:
+            indices, elements = zip(*remaining)
+            self.lengths = dict(zip(indices, input_lengths(list(elements))))
+            if max_input_length:
+                for i, length in self.lengths.items():
+                    if length > max_input_length:
+                        self.overflowing.append(i)
+                        self.lengths[i] = max_input_length
+            remaining.sort(key=lambda e: self.lengths[e[0]], reverse=True)
+        self.pending = deque(remaining)
         self.check_done()
 
     def __del__(self):
@@ -69,15 +339,67 @@ class Work:
     def add_cached(self):
         for i, e in self.get_remaining():
             try:
-                self.add_processed(i, self.cache.get([e, self.arguments_hash]))
+                instance = self.cache.get([e, self.arguments_hash])
             except KeyError:
-                pass
+                continue
+            if self.timings is not None:
+                self.timings[i] = {"cached": True}
+            self.set_processed(i, instance)
 
     def get_remaining(self):
         return [
             e for e, is_set in zip(enumerate(self.batch), self.is_set) if not is_set
         ]
 
+    def element_key(self, i):
+        try:
+            return self.keys[i]
+        except KeyError:
+            key = self.keys[i] = (self.arguments_key, to_bytes(self.batch[i]))
+            return key
+
+    def num_pending(self):
+        return len(self.pending)
+
+    def num_pending_tokens(self):
+        return sum(self.length(i) for i, _ in self.pending)
+
+    def requeue(self, i, length=None):
+        self.pending.appendleft((i, self.batch[i]))
+        if length is not None:
+            self.lengths[i] = length
+
+    def discard_pending(self, i):
+        self.pending = deque(e for e in self.pending if e[0] != i)
+
+    def wait_time(self):
+        return time.monotonic() - self.waiting_since
+
+    def length(self, i):
+        return self.lengths.get(i, 0)
+
+    def take(self, size, token_budget=0, num_taken=0, max_length=0):
+        taken = []
+        while self.pending and len(taken) < size:
+            i, _ = self.pending[0]
+            if self.is_set[i]:
+                self.pending.popleft()
+                continue
+            length = max(max_length, self.length(i))
+            count = num_taken + len(taken) + 1
+            if token_budget and count > 1 and length * count > token_budget:
+                break
+            max_length = length
+            taken.append(self.pending.popleft())
+        self.waiting_since = time.monotonic()
+        if self.timings is not None:
+            for i, _ in taken:
+                self.timings[i] = {
+                    "cached": False,
+                    "queue_wait": self.waiting_since - self.submitted,
+                }
+        return taken
+
     def set_done(self, results):
         self.event_box.set_done(results)
 
@@ -87,6 +409,12 @@ class Work:
     def set_application_error(self, message):
         self.event_box.set_application_error(message)
 
+    def set_overloaded(self, message, retry_after):
+        self.event_box.set_overloaded(message, retry_after)
+
+    def set_expired(self, message):
+        self.event_box.set_expired(message)
+
     def is_done(self):
         return self.event_box.any_event_is_set()
 
@@ -94,48 +422,202 @@ class Work:
         if self.remaining == 0:
             self.set_done(self.results)
 
+    def cache_key(self, i):
+        return [self.batch[i], self.arguments_hash]
+
+    def share(self, i, instance):
+        if self.single_flight is not None and i in self.keys:
+            self.single_flight.resolve(self.keys[i], instance)
+
+    def set_processed(self, i, instance):
+        if self.timings is not None and self.timings[i] is None:
+            self.timings[i] = {"cached": False, "shared": True}
+        self.results[i] = instance
+        self.is_set[i] = True
+        self.remaining -= 1
+        self.check_done()
+
     def add_processed(self, i, instance):
         if self.is_set[i]:
             self.set_error(f"element {i} was already set")
         else:
-            self.cache.set([self.batch[i], self.arguments_hash], instance)
-            self.results[i] = instance
-            self.is_set[i] = True
-            self.remaining -= 1
-            self.check_done()
+            self.set_processed(i, instance)
+            self.share(i, instance)
 
 
 class Workers:
-    def __init__(self, func, num_threads=1, batch_size=32, cache_size=0):
+    def __init__(
+        self,
+        func,
+        num_threads=1,
+        batch_size=32,
+        cache_size=0,
+        disk_cache_size=0,
+        cache_path=None,
+        cache_warm_path=None,
+        scheduler=None,
+        pool=None,
+        controller=None,
+        memory_headroom=None,
+        input_lengths=None,
+        token_budget=0,
+        max_waiting_requests=0,
+        max_waiting_elements=0,
+        max_queued_tokens=0,
+        max_input_length=0,
+        reject_overflow=False,
+        throughput_window=64,
+    ):
         assert num_threads > 0, "the number of threads has to be at least 1"
-        self.batcher = Batcher(batch_size)
-        self.cache = Cache(cache_size)
+        self.metrics = Registry(prefix="language_model")
+        self.batcher = Batcher(
+            batch_size,
+            token_budget=token_budget,
+            queue_wait=self.metrics.histogram(
+                "queue_wait_seconds", "Seconds a request waited before being batched"
+            ),
+        )
+        self.single_flight = SingleFlight(self._requeue)
+        self.finishing = set()
+        self.input_lengths = input_lengths
+        self.max_waiting_requests = max_waiting_requests
+        self.max_waiting_elements = max_waiting_elements
+        self.max_queued_tokens = max_queued_tokens
+        self.max_input_length = max_input_length
+        self.reject_overflow = reject_overflow
+        self.completions = deque(maxlen=throughput_window)
+        self.num_rejected = 0
+        self.num_rejected_overflow = 0
+        self.num_expired = 0
+        self.cache = Cache(
+            cache_size, disk_path=cache_path, disk_size=disk_cache_size * 1024**2
+        )
+        self.cache_warm_path = cache_warm_path
         self.num_threads = num_threads
         self.func = func
+        parameters = inspect.signature(func).parameters
+        self.supports_streaming = "_stream" in parameters
+        self.supports_timings = "_timings" in parameters
+        self.supports_cancel = "_cancel" in parameters
+        self.scheduler = scheduler
+        self.pool = pool
+        self.max_running = num_threads if pool is None else pool.num_processes
+        self.controller = controller
+        self.memory_headroom = memory_headroom
         self.curr_processing_size = 0
         self.worker_process = None
         self.threads = set()
+        self._build_metrics()
+        if controller is not None:
+            self._apply_controller()
+
+    def _build_metrics(self):
+        metrics = self.metrics
+        self.batch_seconds = metrics.histogram(
+            "batch_seconds", "Seconds to compute one batch"
+        )
+        self.request_seconds = metrics.histogram(
+            "request_seconds", "Seconds from submitting a request until it finished"
+        )
+        self.requests_total = metrics.counter(
+            "requests_total", "Finished requests by result type"
+        )
+        self.prompts_total = metrics.counter("prompts_total", "Computed elements")
+        self.input_tokens_total = metrics.counter(
+            "input_tokens_total", "Input tokens of computed elements"
+        )
+        self.output_tokens_total = metrics.counter(
+            "output_tokens_total", "Output tokens of computed elements"
+        )
+        self.dropped_expired_total = metrics.counter(
+            "dropped_expired_total",
+            "Elements dropped because their deadline passed before they were computed",
+        )
+        self.batch_fill_ratio = metrics.gauge(
+            "batch_fill_ratio", "Size of the last batch relative to the batch size"
+        )
+        metrics.counter(
+            "cache_hits_total", "Cache hits", function=lambda: self.cache.hits
+        )
+        metrics.counter(
+            "cache_misses_total", "Cache misses", function=lambda: self.cache.misses
+        )
+        metrics.counter(
+            "deduplicated_elements_total",
+            "Elements that shared the computation of an identical element",
+            function=lambda: self.single_flight.num_deduplicated,
+        )
+        metrics.gauge(
+            "waiting_requests",
+            "Requests in the queue",
+            function=self.num_waiting_requests,
+        )
+        metrics.gauge(
+            "waiting_elements",
+            "Elements in the queue",
+            function=self.num_waiting_elements,
+        )
+        metrics.gauge(
+            "running_elements",
+            "Elements that are computed",
+            function=self.num_running_elements,
+        )
 
     def settings(self):
-        return {
+        settings = {
             "threads": self.num_threads,
             "batch size": self.batcher.batch_size,
-            "cache size": self.cache.cache.maxsize,
+            "token budget": self.batcher.token_budget,
+            "max waiting requests": self.max_waiting_requests,
+            "max waiting elements": self.max_waiting_elements,
+            "max queued tokens": self.max_queued_tokens,
+            "reject overflow": self.reject_overflow,
+            **self.cache.settings(),
         }
+        if self.scheduler is not None:
+            settings.update(self.scheduler.settings())
+        if self.pool is not None:
+            settings.update(self.pool.settings())
+        if self.controller is not None:
+            settings.update(self.controller.settings())
+        return settings
 
     def statistics(self):
-        return self.settings() | {
-            "items in cache": self.cache.cache.currsize,
-            "running threads": self.num_running_threads(),
-            "running elements": self.num_running_elements(),
-            "waiting requests": self.num_waiting_requests(),
-            "waiting elements": self.num_waiting_elements(),
-        }
+        statistics = (
+            self.settings()
+            | self.cache.statistics()
+            | {
+                "running threads": self.num_running_threads(),
+                "running elements": self.num_running_elements(),
+                "waiting requests": self.num_waiting_requests(),
+                "waiting elements": self.num_waiting_elements(),
+                "waiting tokens": self.batcher.num_waiting_tokens(),
+                "elements per second": round(self.throughput(), 4),
+                "rejected requests": self.num_rejected,
+                "rejected overflowing requests": self.num_rejected_overflow,
+                "expired requests": self.num_expired,
+            }
+            | self.batcher.statistics()
+            | self.single_flight.statistics()
+        )
+        if self.scheduler is not None:
+            statistics.update(self.scheduler.statistics())
+        if self.pool is not None:
+            statistics.update(self.pool.statistics())
+        if self.controller is not None:
+            statistics.update(self.controller.statistics())
+        return statistics
 
     def startup(self):
         if self.worker_process is not None:
             raise ValueError("workers are already running")
         else:
+            if self.cache_warm_path is not None:
+                self.cache.load_file(self.cache_warm_path)
+            if self.scheduler is not None:
+                self.scheduler.startup()
+            if self.pool is not None:
+                self.pool.startup()
             self.worker_process = self._start_work()
 
     def shutdown(self):
@@ -144,6 +626,10 @@ class Workers:
         else:
             self.worker_process.cancel()
             self.worker_process = None
+            if self.scheduler is not None:
+                self.scheduler.shutdown()
+            if self.pool is not None:
+                self.pool.shutdown()
 
     def num_running_threads(self):
         return len([t for t in self.threads if not t.done()])
@@ -157,47 +643,319 @@ class Workers:
     def num_waiting_elements(self):
         return self.batcher.num_waiting_elements()
 
-    def submit(self, event_box, data):
-        work = Work(event_box, data, cache=self.cache)
-        if not work.is_done():
+    def throughput(self):
+        if len(self.completions) < 2:
+            return 0.0
+        elapsed = time.monotonic() - self.completions[0][0]
+        if elapsed <= 0:
+            return 0.0
+        return sum(size for _, size in self.completions) / elapsed
+
+    def retry_after(self):
+        throughput = self.throughput()
+        if not throughput:
+            return 1
+        seconds = math.ceil(self.num_waiting_elements() / throughput)
+        return max(1, min(seconds, MAX_RETRY_AFTER))
+
+    def _add_completion(self, results, elapsed, mode):
+        self.completions.append((time.monotonic(), len(results)))
+        self.batch_seconds.observe(elapsed, mode=mode)
+        self.prompts_total.inc(len(results))
+        for result in results:
+            try:
+                size = result["size"]
+                self.input_tokens_total.inc(size["input"])
+                self.output_tokens_total.inc(size["output"])
+            except (TypeError, KeyError):
+                pass
+
+    def _adapt(self, targets, elapsed):
+        if self.controller.limits_tokens:
+            lengths = targets.lengths()
+            used = max(lengths) * len(lengths)
+        else:
+            used = len(targets)
+        headroom = None
+        if self.memory_headroom is not None:
+            headroom = self.memory_headroom()
+        backlog = self.num_waiting_elements()
+        if self.controller.observe(elapsed, used, backlog, headroom):
+            self._apply_controller()
+
+    def _apply_controller(self):
+        if self.controller.limits_tokens:
+            self.batcher.token_budget = self.controller.limit
+        else:
+            self.batcher.batch_size = self.controller.limit
+        self.max_running = self.controller.concurrency
+
+    def _observe_request(self, event_box, submitted):
+        if event_box.disconnect_event.is_set():
+            result = "disconnected"
+        else:
+            result = event_box.result_type.name.lower()
+        self.requests_total.inc(result=result)
+        self.request_seconds.observe(time.monotonic() - submitted)
+
+    def _exceeded_limit(self, work):
+        num_pending = work.num_pending()
+        limits = [
+            (self.max_waiting_requests, self.num_waiting_requests(), 1, "requests"),
+            (
+                self.max_waiting_elements,
+                self.num_waiting_elements(),
+                num_pending,
+                "elements",
+            ),
+            (
+                self.max_queued_tokens,
+                self.batcher.num_waiting_tokens(),
+                work.num_pending_tokens(),
+                "tokens",
+            ),
+        ]
+        for limit, waiting, added, name in limits:
+            if limit and waiting and waiting + added > limit:
+                return f"the server is overloaded, {waiting} {name} are waiting and the limit is {limit}"
+        return None
+
+    @staticmethod
+    def _parse_deadline(submitted, timeout, deadline):
+        if timeout is not None:
+            deadline = submitted + float(timeout)
+        elif deadline is not None:
+            deadline = submitted + float(deadline) - time.time()
+        if deadline is not None and not math.isfinite(deadline):
+            raise ValueError("the deadline has to be finite")
+        return deadline
+
+    def submit(
+        self,
+        event_box,
+        data,
+        stream=None,
+        priority=None,
+        client=None,
+        timing=False,
+        timeout=None,
+        deadline=None,
+    ):
+        submitted = time.monotonic()
+        if stream is not None and not self.supports_streaming:
+            raise ValueError("the model does not support streaming")
+        if priority is None:
+            priority = DEFAULT_PRIORITY
+        if priority not in PRIORITY_WEIGHTS:
+            event_box.set_error(
+                f"unknown priority '{priority}', has to be one of {list(PRIORITY_WEIGHTS)}"
+            )
+            self._observe_request(event_box, submitted)
+            return
+        try:
+            deadline = self._parse_deadline(submitted, timeout, deadline)
+        except ValueError:
+            event_box.set_error("the timeout and the deadline have to be numbers")
+            self._observe_request(event_box, submitted)
+            return
+        work = Work(
+            event_box,
+            data,
+            cache=self.cache,
+            stream=stream,
+            priority=priority,
+            client=client or DEFAULT_CLIENT,
+            input_lengths=self.input_lengths,
+            single_flight=self.single_flight,
+            max_input_length=self.max_input_length,
+            timing=timing,
+        )
+        finish = asyncio.ensure_future(self._finish(work, submitted))
+        self.finishing.add(finish)
+        finish.add_done_callback(self.finishing.discard)
+        if work.is_done():
+            return
+        if deadline is not None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                self._expire(work)
+                return
+            work.expiry = asyncio.get_running_loop().call_later(
+                remaining, self._expire, work
+            )
+        if not work.num_pending():
+            return
+        if self.reject_overflow and work.overflowing:
+            self.num_rejected_overflow += 1
+            work.set_error(
+                f"the elements {work.overflowing} are longer than the maximum input length of {self.max_input_length} tokens"
+            )
+            return
+        message = self._exceeded_limit(work)
+        if message is not None:
+            self.num_rejected += 1
+            work.set_overloaded(message, self.retry_after())
+            return
+        self.batcher.add(work)
+
+    def _expire(self, work):
+        if work.is_done():
+            return
+        self.num_expired += 1
+        self.dropped_expired_total.inc(work.num_pending())
+        work.set_expired(
+            f"the deadline passed before the request was processed, {work.remaining} elements were not processed"
+        )
+        self.single_flight.release(work)
+
+    async def _finish(self, work, submitted):
+        await work.event_box.wait()
+        if work.expiry is not None:
+            work.expiry.cancel()
+        self.single_flight.release(work)
+        self._observe_request(work.event_box, submitted)
+
+    def _requeue(self, work, i):
+        length = None
+        if self.input_lengths is not None and i not in work.lengths:
+            (length,) = self.input_lengths([work.batch[i]])
+        work.requeue(i, length)
+        if not work.is_queued:
             self.batcher.add(work)
 
+    def _stream_callback(self, targets):
+        loop = asyncio.get_running_loop()
+
+        def stream(i, text):
+            loop.call_soon_threadsafe(targets.stream, i, text)
+
+        return stream
+
+    async def _run(self, targets, batch):
+        if self.pool is not None:
+            return await self.pool.run(batch)
+        thread = CancableThread(target=lambda: self.func(**batch))
+        if self.supports_cancel:
+            return await thread.run_until_finish()
+        return await thread.run_until_finish_or_event(targets)
+
     @to_future
-    async def _process(self, work, indices, batch):
-        size = len(batch["batch"])
+    async def _process(self, targets, batch):
+        size = len(targets)
         self.curr_processing_size += size
+        if targets.has_stream():
+            batch = {**batch, "_stream": self._stream_callback(targets)}
+        timings = None
+        if self.supports_timings and targets.has_timing():
+            timings = {}
+            batch = {**batch, "_timings": timings}
+        if self.supports_cancel and self.pool is None:
+            batch = {**batch, "_cancel": targets.cancel}
         try:
-            thread = CancableThread(target=lambda: self.func(**batch))
+            start = time.monotonic()
             try:
-                results = await thread.run_until_finish_or_event(work.event_box)
+                results = await self._run(targets, batch)
+            except ProcessExitedError as e:
+                targets.set_application_error(str(e))
+                return
             except Exception as e:
-                work.set_error(str(e))
+                targets.set_error(str(e))
+                return
+            if targets.is_done():
                 return
             len_returned = len(results)
             if len_returned == size:
-                for i, e in zip(indices, results):
-                    work.add_processed(i, e)
+                elapsed = time.monotonic() - start
+                self._add_completion(results, elapsed, "static")
+                if self.controller is not None:
+                    self._adapt(targets, elapsed)
+                targets.add_timings(start, elapsed, timings)
+                entries = targets.add_processed(results)
+                await self.cache.set_many_in_thread(entries)
             else:
-                work.set_error(
+                targets.set_error(
                     f"the supplied function returned {len_returned} results instead of {size} results"
                 )
         except (asyncio.CancelledError, SystemExit, KeyboardInterrupt):
             raise
         except Exception as e:
-            work.set_application_error(str(e))
+            targets.set_application_error(str(e))
+        finally:
+            self.curr_processing_size -= size
+
+    @staticmethod
+    def _watch_cancellation(targets, futures):
+        def cancel(work):
+            for i, (other, _) in enumerate(targets.targets):
+                if other is work and targets.cancel(i):
+                    futures[i].cancel()
+
+        watchers = []
+        for work in targets.works:
+            watcher = asyncio.ensure_future(work.event_box.wait())
+            watcher.add_done_callback(lambda _, work=work: cancel(work))
+            watchers.append(watcher)
+        return watchers
+
+    @to_future
+    async def _process_continuous(self, targets, batch):
+        arguments = batch.copy()
+        elements = arguments.pop("batch")
+        size = len(elements)
+        if not targets.has_stream():
+            futures = [self.scheduler.submit(e, arguments) for e in elements]
+        else:
+            futures = [
+                self.scheduler.submit(e, arguments, partial(targets.stream, i))
+                for i, e in enumerate(elements)
+            ]
+        watchers = self._watch_cancellation(targets, futures)
+        self.curr_processing_size += size
+        try:
+            start = time.monotonic()
+            results = await asyncio.gather(*futures, return_exceptions=True)
+            if targets.is_done():
+                return
+            for i, result in enumerate(results):
+                if i not in targets.cancelled and isinstance(result, BaseException):
+                    targets.set_error(str(result))
+                    return
+            elapsed = time.monotonic() - start
+            completed = [
+                result for i, result in enumerate(results) if i not in targets.cancelled
+            ]
+            self._add_completion(completed, elapsed, "continuous")
+            targets.add_timings(start, elapsed)
+            entries = targets.add_processed(results)
+            await self.cache.set_many_in_thread(entries)
+        except (asyncio.CancelledError, SystemExit, KeyboardInterrupt):
+            raise
+        except Exception as e:
+            targets.set_application_error(str(e))
         finally:
+            for watcher in watchers:
+                watcher.cancel()
+            for future in futures:
+                future.cancel()
             self.curr_processing_size -= size
 
     @to_future
     async def _start_work(self):
         try:
             async for batch in self.batcher.consume():
-                self.threads.add(self._process(*batch))
-                if len(self.threads) >= self.num_threads:
-                    _, self.threads = await asyncio.wait(
-                        self.threads, return_when=asyncio.FIRST_COMPLETED
-                    )
-                del batch
+                targets, _ = batch
+                self.batch_fill_ratio.set(len(targets) / self.batcher.batch_size)
+                if self.scheduler is not None:
+                    await self.scheduler.reserve(len(targets))
+                    self.threads = {t for t in self.threads if not t.done()}
+                    self.threads.add(self._process_continuous(*batch))
+                else:
+                    self.threads.add(self._process(*batch))
+                    while len(self.threads) >= self.max_running:
+                        _, self.threads = await asyncio.wait(
+                            self.threads, return_when=asyncio.FIRST_COMPLETED
+                        )
+                del batch, targets
         finally:
             for t in self.threads:
                 t.cancel()